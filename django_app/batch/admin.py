@@ -1,16 +1,73 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Q
 
 from .models import BatchUpload, BatchItem
+from .normalize import phone_prefix_ranges
+from .pagination import EstimatedCountPaginator
 
 
 @admin.register(BatchUpload)
 class BatchUploadAdmin(admin.ModelAdmin):
     list_display = ('id', 'original_filename', 'status', 'created_at', 'uploaded_by', 'total_rows', 'processed_rows', 'errors')
+    list_select_related = ('uploaded_by',)
     readonly_fields = ('created_at',)
+    search_fields = ('=id', 'original_filename')
+
+
+class RecentBatchListFilter(admin.SimpleListFilter):
+    """Filter items by batch without loading every batch into the sidebar."""
+    title = 'batch'
+    parameter_name = 'batch'
+    recent = 20
+
+    def lookups(self, request, model_admin):
+        batches = list(BatchUpload.objects.order_by('-id')[:self.recent])
+        selected = self.value()
+        if selected and selected.isdigit() and all(str(b.id) != selected for b in batches):
+            batches += list(BatchUpload.objects.filter(id=selected))
+        return [(str(batch.id), str(batch)) for batch in batches]
+
+    def queryset(self, request, queryset):
+        if self.value() and self.value().isdigit():
+            return queryset.filter(batch_id=self.value())
+        return queryset
+
+
+class BatchItemChangeList(ChangeList):
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(request, *args, **kwargs)
+        # the date drill-down aggregates over every matching row, so it is
+        # only offered once the list is narrowed to a single batch
+        if RecentBatchListFilter.parameter_name not in request.GET:
+            self.date_hierarchy = None
 
 
 @admin.register(BatchItem)
 class BatchItemAdmin(admin.ModelAdmin):
     list_display = ('id', 'batch', 'row_number', 'phone', 'amount', 'status', 'processed_at')
-    list_filter = ('status',)
-    search_fields = ('phone',)
+    list_filter = ('status', RecentBatchListFilter)
+    list_select_related = ('batch',)
+    raw_id_fields = ('batch',)
+    search_fields = ('=phone_number',)
+    search_help_text = 'Full phone number or prefix, e.g. +26134'
+    date_hierarchy = 'processed_at'
+    paginator = EstimatedCountPaginator
+    # skip the unfiltered "N total" COUNT(*) shown next to filtered results
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return BatchItemChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # phones are stored as packed E.164 integers, so the term is turned
+        # into index range scans covering every number with that prefix
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        ranges = phone_prefix_ranges(search_term)
+        if not ranges:
+            return queryset.none(), False
+        condition = Q()
+        for low, high in ranges:
+            condition |= Q(phone_number__gte=low, phone_number__lt=high)
+        return queryset.filter(condition), False
@@ -0,0 +1,147 @@
+import logging
+import math
+from time import monotonic
+
+from celery.worker.autoscale import Autoscaler
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+LATENCY_EWMA_ALPHA = 0.2
+
+
+def _latency_key(queue):
+    return f'autoscale:latency:{queue}'
+
+
+def _decision_key(queue):
+    return f'autoscale:decision:{queue}'
+
+
+def record_send_latency(queue, seconds):
+    """Fold one observed send duration into the queue's moving average."""
+    previous = cache.get(_latency_key(queue))
+    if previous is None:
+        value = seconds
+    else:
+        value = LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * previous
+    cache.set(_latency_key(queue), value, timeout=None)
+
+
+def send_latency(queue):
+    return cache.get(_latency_key(queue))
+
+
+def _is_not_found(exc):
+    return getattr(exc, 'reply_code', None) in (404, '404')
+
+
+def queue_depths(app, queues):
+    """Messages waiting in each of ``queues`` on the broker ({queue: depth}).
+
+    One broker connection is used for all queues. A queue the broker does not
+    know (the Redis transport deletes the list of an emptied queue) has depth
+    0; a depth that cannot be read at all is None.
+    """
+    depths = dict.fromkeys(queues)
+    try:
+        with app.connection_for_read() as conn:
+            for queue in queues:
+                # a failed passive declare closes the channel on AMQP brokers,
+                # so each queue gets its own
+                channel = conn.channel()
+                try:
+                    depths[queue] = channel.queue_declare(queue=queue, passive=True).message_count
+                except Exception as exc:
+                    if not _is_not_found(exc):
+                        raise
+                    depths[queue] = 0
+                finally:
+                    channel.close()
+    except Exception:
+        logger.exception('Failed to read depth of queues %s', ', '.join(queues))
+    return depths
+
+
+def backlog_processes(depth, latency, drain_seconds):
+    """Processes needed to drain ``depth`` messages within ``drain_seconds``.
+
+    Each process sends one item every ``latency`` seconds.
+    """
+    if depth and latency:
+        return math.ceil(depth * latency / drain_seconds)
+    return 1 if depth else 0
+
+
+def desired_concurrency(backlogs, in_flight, min_concurrency, max_concurrency, drain_seconds):
+    """Pool size for a worker consuming queues with ``backlogs`` [(depth, latency)].
+
+    The queues' backlogs add up (two queues needing 4 processes each need 8),
+    on top of the ``in_flight`` processes already busy with reserved tasks.
+    """
+    needed = in_flight + sum(backlog_processes(depth, latency, drain_seconds) for depth, latency in backlogs)
+    return max(min_concurrency, min(max_concurrency, needed))
+
+
+def record_decision(queue, **decision):
+    decision['queue'] = queue
+    decision['decided_at'] = timezone.now().isoformat()
+    cache.set(_decision_key(queue), decision, timeout=None)
+
+
+def scaling_decisions(queues):
+    """Latest autoscaler decision for each queue (None if none was made yet)."""
+    return {queue: cache.get(_decision_key(queue)) for queue in queues}
+
+
+class QueueDepthAutoscaler(Autoscaler):
+    """Size the worker pool from queue depth and observed send latency.
+
+    Celery's default autoscaler only looks at tasks already reserved by the
+    worker, which with a prefetch of 1 never exceeds the pool size. This one
+    samples the backlog of the queues the worker consumes from, so a worker
+    dedicated to one modem group grows with that group's load alone. Works
+    for prefork processes as well as gevent/eventlet coroutine pools.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sampled_at = None
+        self._desired = self.min_concurrency
+
+    def _consumed_queues(self):
+        return sorted(self.worker.app.amqp.queues.consume_from)
+
+    def _sample(self):
+        in_flight = super().qty
+        drain_seconds = settings.BATCH_AUTOSCALE_DRAIN_SECONDS
+        queues = self._consumed_queues()
+        depths = queue_depths(self.worker.app, queues)
+        backlogs = {queue: (depths[queue], send_latency(queue)) for queue in queues}
+        desired = desired_concurrency(
+            backlogs.values(), in_flight, self.min_concurrency, self.max_concurrency, drain_seconds,
+        )
+        for queue, (depth, latency) in backlogs.items():
+            record_decision(
+                queue,
+                depth=depth,
+                latency=latency,
+                in_flight=in_flight,
+                backlog_processes=backlog_processes(depth, latency, drain_seconds),
+                processes=self.processes,
+                desired=desired,
+                min=self.min_concurrency,
+                max=self.max_concurrency,
+                hostname=getattr(self.worker, 'hostname', None),
+            )
+        return desired
+
+    @property
+    def qty(self):
+        now = monotonic()
+        if self._sampled_at is None or now - self._sampled_at >= settings.BATCH_AUTOSCALE_SAMPLE_SECONDS:
+            self._sampled_at = now
+            self._desired = self._sample()
+        return self._desired
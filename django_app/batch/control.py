@@ -0,0 +1,44 @@
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import BatchUpload
+
+# Flag values stored per batch; no flag means the batch runs normally
+CONTROL_PAUSED = BatchUpload.STATUS_PAUSED
+CONTROL_CANCELLED = BatchUpload.STATUS_CANCELLED
+
+# Per-process copy of recent "no flag" reads: {batch_id: read_at}.
+# Workers check the flag once per item; this keeps the common case (a running
+# batch) a dict lookup and limits the shared cache (Redis) to one read per
+# batch per BATCH_CONTROL_LOCAL_TTL seconds. A set flag is never kept here:
+# after a resume the re-enqueued items would otherwise see a stale pause and
+# be dropped.
+_local_flags = {}
+
+
+def _control_key(batch_id):
+    return f'batch-control:{batch_id}'
+
+
+def set_batch_control(batch_id, value):
+    """Set (or clear, with ``None``) the control flag of a batch."""
+    if value is None:
+        cache.delete(_control_key(batch_id))
+    else:
+        cache.set(_control_key(batch_id), value, timeout=None)
+    _local_flags.pop(batch_id, None)
+
+
+def get_batch_control(batch_id):
+    now = monotonic()
+    read_at = _local_flags.get(batch_id)
+    if read_at is not None and now - read_at < settings.BATCH_CONTROL_LOCAL_TTL:
+        return None
+    value = cache.get(_control_key(batch_id))
+    if value is None:
+        _local_flags[batch_id] = now
+    else:
+        _local_flags.pop(batch_id, None)
+    return value
@@ -0,0 +1,57 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from batch.models import BatchItem
+from batch.renderers import ORJSONRenderer
+from batch.serializers import ITEM_ROW_COLUMNS, BatchItemSerializer, encode_item_rows
+
+
+def _sample_rows(count):
+    now = timezone.now()
+    rows = []
+    for i in range(1, count + 1):
+        rows.append((
+            i, i, 261340000000 + i, 1000 + i, BatchItem.STATUS_SUCCESS, 'Mocked USSD: OK',
+            now - timedelta(seconds=i), 1,
+        ))
+    return rows
+
+
+def _rows_per_second(func, count, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best if best else float('inf')
+
+
+class Command(BaseCommand):
+    help = 'Measure rows/s of the item listing serialisation: ModelSerializer path vs values_list fast path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        count, repeat = options['rows'], options['repeat']
+        rows = _sample_rows(count)
+        # What the ORM hands each path: model instances vs plain tuples
+        instances = [BatchItem(**dict(zip(ITEM_ROW_COLUMNS, row))) for row in rows]
+
+        before = _rows_per_second(
+            lambda: JSONRenderer().render(BatchItemSerializer(instances, many=True).data), count, repeat,
+        )
+        after = _rows_per_second(
+            lambda: ORJSONRenderer().render(encode_item_rows(rows)), count, repeat,
+        )
+
+        self.stdout.write(f'rows: {count} (best of {repeat})')
+        self.stdout.write(f'ModelSerializer + JSONRenderer:  {before:,.0f} rows/s')
+        self.stdout.write(f'values_list + ORJSONRenderer:    {after:,.0f} rows/s')
+        self.stdout.write(f'speed-up: {after / before:.1f}x')
@@ -0,0 +1,92 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from batch.simulation import LATENCY_DISTRIBUTIONS, simulate_batch
+from batch.tasks import MOCK_SEND_SECONDS, MOCK_SUCCESS_RATE
+
+
+def _fmt(seconds):
+    if seconds is None:
+        return '-'
+    return str(timedelta(seconds=round(seconds)))
+
+
+class Command(BaseCommand):
+    help = 'Estimate batch completion time, modem utilisation and queue depth with a discrete-event simulation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--modems', type=int, default=1, help='Concurrent sends (total worker concurrency)')
+        parser.add_argument('--retries', type=int, default=None,
+                            help='Extra attempts per item (default: BATCH_ITEM_MAX_ATTEMPTS - 1)')
+        parser.add_argument('--retry-failures', action='store_true',
+                            help='Also retry failed sends (today only crashed sends are retried)')
+        parser.add_argument('--latency', type=float, default=MOCK_SEND_SECONDS, help='Mean send latency in seconds')
+        parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='fixed')
+        parser.add_argument('--latency-spread', type=float, default=0.25)
+        parser.add_argument('--failure-rate', type=float, default=1 - MOCK_SUCCESS_RATE)
+        parser.add_argument('--crash-rate', type=float, default=0.0, help='Fraction of sends whose worker dies')
+        parser.add_argument('--runs', type=int, default=1, help='Independent runs (reports the spread of batch times)')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['items'] < 1 or options['modems'] < 1 or options['runs'] < 1:
+            raise CommandError('--items, --modems and --runs must be at least 1')
+        if options['latency'] <= 0:
+            raise CommandError('--latency must be positive')
+        if options['latency_spread'] < 0:
+            raise CommandError('--latency-spread must not be negative')
+        if not 0 <= options['failure_rate'] <= 1 or not 0 <= options['crash_rate'] <= 1:
+            raise CommandError('--failure-rate and --crash-rate must be between 0 and 1')
+        max_attempts = (
+            settings.BATCH_ITEM_MAX_ATTEMPTS if options['retries'] is None else options['retries'] + 1
+        )
+
+        started = time.perf_counter()
+        results = [
+            simulate_batch(
+                options['items'],
+                options['modems'],
+                max_attempts=max_attempts,
+                latency=options['latency'],
+                latency_distribution=options['latency_dist'],
+                latency_spread=options['latency_spread'],
+                failure_rate=options['failure_rate'],
+                crash_rate=options['crash_rate'],
+                retry_failures=options['retry_failures'],
+                seed=None if options['seed'] is None else options['seed'] + run,
+            )
+            for run in range(options['runs'])
+        ]
+        elapsed = time.perf_counter() - started
+
+        first = results[0]
+        self.stdout.write(
+            f"{options['items']} items on {options['modems']} modems, up to {max_attempts} attempts, "
+            f"{options['latency_dist']} latency {options['latency']}s, failure rate {options['failure_rate']:.1%}, "
+            f"crash rate {options['crash_rate']:.1%}"
+        )
+        durations = sorted(result['duration'] for result in results)
+        if len(results) > 1:
+            self.stdout.write(
+                f'Batch completion over {len(results)} runs: min {_fmt(durations[0])}, '
+                f'median {_fmt(durations[len(durations) // 2])}, max {_fmt(durations[-1])}'
+            )
+        else:
+            self.stdout.write(f"Batch completion: {_fmt(first['duration'])} ({first['status']})")
+        percentiles = first['completion_percentiles']
+        self.stdout.write(
+            'Item completion: ' + ', '.join(f'{label} {_fmt(value)}' for label, value in percentiles.items())
+        )
+        self.stdout.write(
+            f"Sends: {first['sends']} ({first['retries']} retries, {first['crashes']} crashes), "
+            f"failed items: {first['failed']}"
+        )
+        self.stdout.write(f"Modem utilisation: {first['utilisation']:.1%}")
+        self.stdout.write('Queue depth over time:')
+        for at, depth in first['queue_depth']:
+            self.stdout.write(f'  {_fmt(at):>10}  {depth}')
+        self.stdout.write(f'Simulated in {elapsed:.2f}s')
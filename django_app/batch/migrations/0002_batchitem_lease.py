@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:32
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def expire_orphaned_items(apps, schema_editor):
+    # Items left in 'processing' before leases existed can only be stuck;
+    # give them an already-expired lease so the reaper recovers them.
+    BatchItem = apps.get_model('batch', 'BatchItem')
+    BatchItem.objects.filter(status='processing', lease_expires_at__isnull=True).update(
+        lease_expires_at=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('batch', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchitem',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='batchitem',
+            index=models.Index(condition=models.Q(('status', 'processing')), fields=['lease_expires_at'], name='batchitem_inflight_lease_idx'),
+        ),
+        migrations.RunPython(expire_orphaned_items, migrations.RunPython.noop),
+    ]
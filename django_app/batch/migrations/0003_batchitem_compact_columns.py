@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # First of three steps (add, backfill, drop) so a failed backfill leaves
+    # both representations in place and the migration can simply be re-run.
+
+    dependencies = [
+        ('batch', '0002_batchitem_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchitem',
+            name='phone_number',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='batchitem',
+            name='amount_minor',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='batchitem',
+            name='phone',
+            field=models.CharField(max_length=32, null=True),
+        ),
+        migrations.AlterField(
+            model_name='batchitem',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=12, null=True),
+        ),
+    ]
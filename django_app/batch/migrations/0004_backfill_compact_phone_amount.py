@@ -0,0 +1,134 @@
+# Generated by Django 4.2.30 on 2026-10-19 20:05
+
+import re
+from decimal import Decimal
+
+from django.db import migrations, transaction
+from django.db.models import CharField, DecimalField, ExpressionWrapper, F, Max, Min, Value
+from django.db.models.functions import Cast, Concat, Round
+
+CHUNK_SIZE = 5000
+DEFAULT_COUNTRY_CODE = '261'
+NATIONAL_NUMBER_DIGITS = 9
+# How many offending ids to list when aborting
+MAX_REPORTED_IDS = 50
+
+
+def _phone_to_int(phone):
+    # Frozen copy of batch.normalize.phone_digits; None for unparseable values
+    number = (phone or '').strip()
+    if number.endswith('.0'):
+        # numeric Excel cells were stored as str(float)
+        number = number[:-2]
+    number = re.sub(r'[\s\-().]', '', number)
+    if number.isdigit() and number[0] != '0' and len(number) <= NATIONAL_NUMBER_DIGITS:
+        # numeric cells lost the national trunk 0 (stored as str(int) or
+        # str(float), indistinguishable from text here); too short to carry a
+        # country code, so the number is national
+        number = DEFAULT_COUNTRY_CODE + number
+    elif number.startswith('+'):
+        number = number[1:]
+    elif number.startswith('00'):
+        number = number[2:]
+    elif number.startswith('0'):
+        number = DEFAULT_COUNTRY_CODE + number[1:]
+    if not number.isdigit() or not 8 <= len(number) <= 15 or number[0] == '0':
+        return None
+    return int(number)
+
+
+def _id_ranges(BatchItem, db):
+    """[low, high) id ranges of CHUNK_SIZE covering the table."""
+    bounds = BatchItem.objects.using(db).aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return
+    for low in range(bounds['low'], bounds['high'] + 1, CHUNK_SIZE):
+        yield low, low + CHUNK_SIZE
+
+
+def _write_phone_numbers(connection, table, pairs):
+    """Set phone_number for (id, phone_number) pairs with one statement per chunk."""
+    table = connection.ops.quote_name(table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            ids, numbers = zip(*pairs)
+            cursor.execute(
+                f'UPDATE {table} AS item SET phone_number = v.phone_number '
+                f'FROM (SELECT unnest(%s::bigint[]) AS id, unnest(%s::bigint[]) AS phone_number) AS v '
+                f'WHERE item.id = v.id',
+                [list(ids), list(numbers)],
+            )
+        else:
+            cursor.executemany(
+                f'UPDATE {table} SET phone_number = %s WHERE id = %s',
+                [(number, item_id) for item_id, number in pairs],
+            )
+
+
+def convert_rows(apps, schema_editor):
+    """Fill the compact columns per id range, one transaction per range.
+
+    Amounts are converted by a single UPDATE per range. Phones need Python
+    parsing, so only (id, phone) pairs are read and the results written back
+    in one statement per range (a join against an unnested array on
+    PostgreSQL). Rows whose phone cannot be parsed keep their legacy value
+    and a NULL ``phone_number``; the migration then aborts listing them,
+    before the legacy columns are dropped, so they can be fixed and the
+    migration re-run.
+    """
+    BatchItem = apps.get_model('batch', 'BatchItem')
+    connection = schema_editor.connection
+    db = connection.alias
+    invalid = []
+    for low, high in _id_ranges(BatchItem, db):
+        chunk = BatchItem.objects.using(db).filter(id__gte=low, id__lt=high)
+        with transaction.atomic(using=db):
+            chunk.update(amount_minor=Round(F('amount') * 100))
+            pairs = []
+            for item_id, phone in chunk.values_list('id', 'phone').iterator():
+                phone_number = _phone_to_int(phone)
+                if phone_number is None:
+                    invalid.append(item_id)
+                else:
+                    pairs.append((item_id, phone_number))
+            if pairs:
+                _write_phone_numbers(connection, BatchItem._meta.db_table, pairs)
+
+    if invalid:
+        shown = ', '.join(str(item_id) for item_id in invalid[:MAX_REPORTED_IDS])
+        more = f' (and {len(invalid) - MAX_REPORTED_IDS} more)' if len(invalid) > MAX_REPORTED_IDS else ''
+        raise RuntimeError(
+            f'{len(invalid)} batch items have a phone that is not a valid E.164 number; '
+            f'fix or delete them and re-run the migration. Item ids: {shown}{more}'
+        )
+
+
+def restore_rows(apps, schema_editor):
+    BatchItem = apps.get_model('batch', 'BatchItem')
+    db = schema_editor.connection.alias
+    for low, high in _id_ranges(BatchItem, db):
+        chunk = BatchItem.objects.using(db).filter(id__gte=low, id__lt=high)
+        # rows a failed backfill never reached still hold their legacy values
+        chunk.filter(phone_number__isnull=False).update(
+            phone=Concat(Value('+'), Cast('phone_number', CharField())),
+        )
+        chunk.filter(amount_minor__isnull=False).update(
+            amount=ExpressionWrapper(
+                F('amount_minor') * Value(Decimal('0.01')), output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+
+class Migration(migrations.Migration):
+    # Each chunk commits on its own so large tables are not rewritten in a
+    # single long transaction; this migration only touches data, so a failure
+    # part way leaves the schema intact and it is safe to re-run.
+    atomic = False
+
+    dependencies = [
+        ('batch', '0003_batchitem_compact_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_rows, restore_rows),
+    ]
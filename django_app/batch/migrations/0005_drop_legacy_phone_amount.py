@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('batch', '0004_backfill_compact_phone_amount'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='batchitem',
+            name='phone',
+        ),
+        migrations.RemoveField(
+            model_name='batchitem',
+            name='amount',
+        ),
+        migrations.AlterField(
+            model_name='batchitem',
+            name='phone_number',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='batchitem',
+            name='amount_minor',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='batchitem',
+            index=models.Index(fields=['batch', 'phone_number'], name='batchitem_batch_phone_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('batch', '0005_drop_legacy_phone_amount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='batchitem',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('success', 'Success'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='pending', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='batchupload',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('paused', 'Paused'), ('cancelled', 'Cancelled')], default='pending', max_length=16),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('batch', '0006_batch_control_statuses'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batchitem',
+            index=models.Index(fields=['phone_number'], name='batchitem_phone_idx'),
+        ),
+    ]
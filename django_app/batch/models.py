@@ -1,19 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
+from .normalize import from_minor_units, int_to_phone, phone_to_int, to_minor_units
+
 
 class BatchUpload(models.Model):
     STATUS_PENDING = 'pending'
     STATUS_PROCESSING = 'processing'
     STATUS_COMPLETED = 'completed'
     STATUS_FAILED = 'failed'
+    STATUS_PAUSED = 'paused'
+    STATUS_CANCELLED = 'cancelled'
 
     STATUS_CHOICES = [
         (STATUS_PENDING, 'Pending'),
         (STATUS_PROCESSING, 'Processing'),
         (STATUS_COMPLETED, 'Completed'),
         (STATUS_FAILED, 'Failed'),
+        (STATUS_PAUSED, 'Paused'),
+        (STATUS_CANCELLED, 'Cancelled'),
     ]
 
     created_at = models.DateTimeField(auto_now_add=True)
@@ -36,42 +45,124 @@ class BatchItem(models.Model):
     STATUS_PROCESSING = 'processing'
     STATUS_SUCCESS = 'success'
     STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
 
     STATUS_CHOICES = [
         (STATUS_PENDING, 'Pending'),
         (STATUS_PROCESSING, 'Processing'),
         (STATUS_SUCCESS, 'Success'),
         (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
     ]
+    FINAL_STATUSES = (STATUS_SUCCESS, STATUS_FAILED, STATUS_CANCELLED)
 
     batch = models.ForeignKey(BatchUpload, related_name='items', on_delete=models.CASCADE)
     row_number = models.IntegerField()
-    phone = models.CharField(max_length=32)
-    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # E.164 number packed as an integer and amount in minor units; use the
+    # ``phone`` and ``amount`` properties for the string/Decimal values.
+    phone_number = models.BigIntegerField()
+    amount_minor = models.BigIntegerField()
 
     status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
     result_message = models.TextField(blank=True)
     processed_at = models.DateTimeField(null=True, blank=True)
     attempt_count = models.IntegerField(default=0)
+    # Heartbeat deadline while a worker holds the item; expired leases are reaped
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['id']
+        indexes = [
+            # exact phone lookups within a batch (item listing filter)
+            models.Index(fields=['batch', 'phone_number'], name='batchitem_batch_phone_idx'),
+            # global phone (prefix) search in the admin
+            models.Index(fields=['phone_number'], name='batchitem_phone_idx'),
+            # Only in-flight rows are indexed, so the reaper's scan stays small
+            # regardless of how many finished items the table holds.
+            models.Index(
+                fields=['lease_expires_at'],
+                name='batchitem_inflight_lease_idx',
+                condition=models.Q(status='processing'),
+            ),
+        ]
+
+    @property
+    def phone(self):
+        return int_to_phone(self.phone_number)
+
+    @phone.setter
+    def phone(self, value):
+        self.phone_number = phone_to_int(value)
+
+    @property
+    def amount(self):
+        return from_minor_units(self.amount_minor)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_minor = to_minor_units(value)
+
+    @staticmethod
+    def _lease_deadline():
+        return timezone.now() + timedelta(seconds=settings.BATCH_ITEM_LEASE_SECONDS)
 
-    def mark_processing(self):
+    def has_active_lease(self):
+        return (
+            self.status == self.STATUS_PROCESSING
+            and self.lease_expires_at is not None
+            and self.lease_expires_at > timezone.now()
+        )
+
+    def mark_processing(self, handoff_lease=None):
+        """Claim the item for this worker.
+
+        The update only matches a pending item, one whose lease expired or,
+        with ``handoff_lease``, one the reaper handed off under that lease, so
+        when duplicate messages race for the same item only one wins. Returns
+        False if the item was claimed elsewhere or reached a final status.
+        """
+        lease = self._lease_deadline()
+        claimable = models.Q(status=self.STATUS_PENDING) | models.Q(
+            models.Q(lease_expires_at__isnull=True) | models.Q(lease_expires_at__lt=timezone.now()),
+            status=self.STATUS_PROCESSING,
+        )
+        if handoff_lease is not None:
+            claimable |= models.Q(status=self.STATUS_PROCESSING, lease_expires_at=handoff_lease)
+        claimed = BatchItem.objects.filter(claimable, pk=self.pk).update(
+            status=self.STATUS_PROCESSING,
+            attempt_count=models.F('attempt_count') + 1,
+            lease_expires_at=lease,
+        )
+        if not claimed:
+            return False
         self.status = self.STATUS_PROCESSING
         self.attempt_count += 1
-        self.save(update_fields=['status', 'attempt_count'])
+        self.lease_expires_at = lease
+        return True
+
+    def heartbeat(self):
+        self.lease_expires_at = self._lease_deadline()
+        self.save(update_fields=['lease_expires_at'])
 
     def mark_success(self, message=''):
         self.status = self.STATUS_SUCCESS
         self.result_message = message
         self.processed_at = timezone.now()
-        self.save(update_fields=['status', 'result_message', 'processed_at'])
+        self.lease_expires_at = None
+        self.save(update_fields=['status', 'result_message', 'processed_at', 'lease_expires_at'])
+
+    def mark_cancelled(self, message='Cancelled'):
+        self.status = self.STATUS_CANCELLED
+        self.result_message = message
+        self.processed_at = timezone.now()
+        self.lease_expires_at = None
+        self.save(update_fields=['status', 'result_message', 'processed_at', 'lease_expires_at'])
 
     def mark_failed(self, message=''):
         self.status = self.STATUS_FAILED
         self.result_message = message
         self.processed_at = timezone.now()
-        self.save(update_fields=['status', 'result_message', 'processed_at'])
+        self.lease_expires_at = None
+        self.save(update_fields=['status', 'result_message', 'processed_at', 'lease_expires_at'])
@@ -0,0 +1,93 @@
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.conf import settings
+
+# Amounts are stored as integer minor units (cents)
+AMOUNT_DECIMAL_PLACES = 2
+AMOUNT_SCALE = 10 ** AMOUNT_DECIMAL_PLACES
+
+_PHONE_SEPARATORS = re.compile(r'[\s\-().]')
+
+
+def to_minor_units(amount):
+    """Convert a user/Excel supplied amount to integer minor units.
+
+    Floats go through ``str()`` so binary artefacts (``10.1`` ->
+    ``10.0999...``) never reach the stored value; extra decimals round half up.
+    """
+    try:
+        value = Decimal(str(amount).strip())
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: {amount!r}')
+    if not value.is_finite():
+        raise ValueError(f'Invalid amount: {amount!r}')
+    return int((value * AMOUNT_SCALE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(minor):
+    if minor is None:
+        return None
+    return (Decimal(minor) / AMOUNT_SCALE).quantize(Decimal(1).scaleb(-AMOUNT_DECIMAL_PLACES))
+
+
+def phone_digits(phone):
+    """Normalise ``phone`` to its E.164 digits (without the leading ``+``).
+
+    ``+`` or ``00`` prefixed numbers are international; a single leading ``0``
+    is a national trunk prefix and is replaced by PHONE_DEFAULT_COUNTRY_CODE.
+    Numeric (Excel) values cannot keep that ``0``, so one of at most
+    PHONE_NATIONAL_NUMBER_DIGITS digits is national too; anything else is
+    assumed to already carry its country code.
+    """
+    numeric = isinstance(phone, (int, float)) and not isinstance(phone, bool)
+    if isinstance(phone, float) and phone.is_integer():
+        # Excel cells often hold phone numbers as floats
+        phone = int(phone)
+    number = _PHONE_SEPARATORS.sub('', str(phone or ''))
+    if numeric and number.isdigit() and len(number) <= settings.PHONE_NATIONAL_NUMBER_DIGITS:
+        number = settings.PHONE_DEFAULT_COUNTRY_CODE + number
+    elif number.startswith('+'):
+        number = number[1:]
+    elif number.startswith('00'):
+        number = number[2:]
+    elif number.startswith('0'):
+        number = settings.PHONE_DEFAULT_COUNTRY_CODE + number[1:]
+    # E.164: at most 15 digits, and no country code starts with 0
+    if not number.isdigit() or not 8 <= len(number) <= 15 or number[0] == '0':
+        raise ValueError(f'Invalid phone number: {phone!r}')
+    return number
+
+
+def phone_to_int(phone):
+    """E.164 number packed into an integer (fits a BIGINT: 15 digits max)."""
+    return int(phone_digits(phone))
+
+
+def int_to_phone(number):
+    if number is None:
+        return None
+    return f'+{number}'
+
+
+def phone_prefix_ranges(prefix):
+    """Integer ranges covering every packed E.164 number starting with ``prefix``.
+
+    A prefix ``p`` of ``k`` digits matches an ``n``-digit number ``N`` when
+    ``p * 10**(n-k) <= N < (p + 1) * 10**(n-k)``; one range per possible
+    length keeps the search an index range scan instead of a text match.
+    """
+    digits = _PHONE_SEPARATORS.sub('', str(prefix or ''))
+    if digits.startswith('+'):
+        digits = digits[1:]
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0'):
+        digits = settings.PHONE_DEFAULT_COUNTRY_CODE + digits[1:]
+    if not digits.isdigit() or len(digits) > 15:
+        return []
+    value = int(digits)
+    return [
+        (value * 10 ** (length - len(digits)), (value + 1) * 10 ** (length - len(digits)))
+        for length in range(max(len(digits), 8), 16)
+    ]
@@ -1,6 +1,61 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
 
+logger = logging.getLogger(__name__)
+
+
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
+
+
+def estimated_row_count(queryset):
+    """Planner estimate of the rows ``queryset`` returns, or None if unavailable.
+
+    Unfiltered querysets read ``pg_class.reltuples`` (kept up to date by
+    autovacuum/ANALYZE); filtered ones use the row estimate of their query
+    plan. Only PostgreSQL provides these, other backends return None.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # -1 means the table was never analysed
+        return row[0] if row and row[0] >= 0 else None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Django paginator that avoids exact ``COUNT(*)`` on very large results.
+
+    When the planner expects at least ADMIN_ESTIMATED_COUNT_THRESHOLD rows the
+    estimate is used as the count; smaller results (where estimates are
+    least accurate and counting is cheap) are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            try:
+                estimate = estimated_row_count(self.object_list)
+            except Exception:
+                logger.exception('Failed to estimate row count, counting exactly')
+                estimate = None
+            if estimate is not None and estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
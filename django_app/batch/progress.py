@@ -0,0 +1,95 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import BatchUpload
+
+# Completions are counted in fixed time buckets with atomic INCRs (O(1) per
+# item); the exponentially weighted rate is folded from the last few buckets
+# when it is read. Only finished buckets are used so partial ones don't drag
+# the rate down.
+
+
+def _bucket(timestamp):
+    return int(timestamp // settings.BATCH_PROGRESS_BUCKET_SECONDS)
+
+
+def _key(batch_id, bucket, kind):
+    return f'progress:{batch_id}:{bucket}:{kind}'
+
+
+def _incr(key, count, timeout):
+    cache.add(key, 0, timeout=timeout)
+    try:
+        cache.incr(key, count)
+    except ValueError:
+        # expired between add() and incr()
+        cache.set(key, count, timeout=timeout)
+
+
+def record_completion(batch_id, failed=False, count=1, now=None):
+    """Count ``count`` items of ``batch_id`` reaching a final status."""
+    bucket = _bucket(time.time() if now is None else now)
+    timeout = (settings.BATCH_PROGRESS_WINDOW_BUCKETS + 2) * settings.BATCH_PROGRESS_BUCKET_SECONDS
+    _incr(_key(batch_id, bucket, 'done'), count, timeout)
+    if failed:
+        _incr(_key(batch_id, bucket, 'failed'), count, timeout)
+
+
+def progress_stats(batch_id, remaining, started_at=None, now=None):
+    """Throughput (items/s), ETA and recent failure rate of a batch.
+
+    ``remaining`` is the number of items not final yet; ``started_at``
+    (a timestamp) keeps buckets from before the batch started out of the
+    average. ``eta_seconds`` is None while no rate is known.
+    """
+    bucket_seconds = settings.BATCH_PROGRESS_BUCKET_SECONDS
+    current = _bucket(time.time() if now is None else now)
+    first = _bucket(started_at) if started_at is not None else None
+    buckets = [
+        current - age for age in range(1, settings.BATCH_PROGRESS_WINDOW_BUCKETS + 1)
+        if first is None or current - age >= first
+    ]
+    keys = [_key(batch_id, bucket, kind) for bucket in buckets for kind in ('done', 'failed')]
+    counts = cache.get_many(keys)
+
+    decay = math.log(2) / settings.BATCH_PROGRESS_HALF_LIFE
+    done = failed = elapsed = 0.0
+    for age, bucket in enumerate(buckets):
+        weight = math.exp(-decay * age * bucket_seconds)
+        done += weight * counts.get(_key(batch_id, bucket, 'done'), 0)
+        failed += weight * counts.get(_key(batch_id, bucket, 'failed'), 0)
+        elapsed += weight * bucket_seconds
+
+    throughput = done / elapsed if elapsed else 0.0
+    if remaining <= 0:
+        eta = 0.0
+    elif throughput > 0:
+        eta = remaining / throughput
+    else:
+        eta = None
+    return {
+        'throughput': round(throughput, 3),
+        'eta_seconds': None if eta is None else round(eta, 1),
+        'failure_rate': round(failed / done, 4) if done else None,
+    }
+
+
+def batch_progress(batch):
+    """``progress_stats`` for a BatchUpload, from its counters only (no item queries)."""
+    if batch.status == BatchUpload.STATUS_PAUSED:
+        remaining = None
+    elif batch.status in (BatchUpload.STATUS_COMPLETED, BatchUpload.STATUS_FAILED, BatchUpload.STATUS_CANCELLED):
+        remaining = 0
+    else:
+        remaining = max(0, batch.total_rows - batch.processed_rows - batch.errors)
+    stats = progress_stats(
+        batch.id, remaining or 0,
+        started_at=batch.created_at.timestamp() if batch.created_at else None,
+    )
+    if remaining is None:
+        # no ETA while paused
+        stats['eta_seconds'] = None
+    return stats
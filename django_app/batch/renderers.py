@@ -0,0 +1,27 @@
+from decimal import Decimal
+
+import orjson
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        # same as DRF with COERCE_DECIMAL_TO_STRING
+        return str(value)
+    if isinstance(value, Promise):
+        return force_str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class ORJSONRenderer(BaseRenderer):
+    """JSON renderer backed by orjson, a drop-in for DRF's JSONRenderer on hot endpoints."""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,24 @@
+from django.conf import settings
+
+
+def queue_for_phone(phone):
+    """Return the Celery queue serving ``phone``.
+
+    Prefixes from BATCH_PHONE_PREFIX_QUEUES are matched longest first, so an
+    operator-specific prefix can override a broader country prefix.
+    """
+    number = ''.join(str(phone or '').split())
+    routes = settings.BATCH_PHONE_PREFIX_QUEUES
+    for prefix in sorted(routes, key=len, reverse=True):
+        if number.startswith(prefix):
+            return routes[prefix]
+    return settings.BATCH_DEFAULT_QUEUE
+
+
+def batch_queues():
+    """All queues batch items can be routed to, default queue first."""
+    queues = [settings.BATCH_DEFAULT_QUEUE]
+    for queue in settings.BATCH_PHONE_PREFIX_QUEUES.values():
+        if queue not in queues:
+            queues.append(queue)
+    return queues
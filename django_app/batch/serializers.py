@@ -1,9 +1,15 @@
+from django.utils import timezone
 from rest_framework import serializers
 from .models import BatchUpload, BatchItem
+from .normalize import AMOUNT_DECIMAL_PLACES, AMOUNT_SCALE
+from .progress import batch_progress
 from account.serializers import UserSerializer
 
 
 class BatchItemSerializer(serializers.ModelSerializer):
+    phone = serializers.CharField(read_only=True)
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
     class Meta:
         model = BatchItem
         fields = ('id', 'row_number', 'phone', 'amount', 'status', 'result_message', 'processed_at', 'attempt_count')
@@ -16,6 +22,12 @@ class BatchUploadSerializer(serializers.ModelSerializer):
         model = BatchUpload
         fields = ('id', 'original_filename', 'status', 'created_at', 'total_rows', 'processed_rows', 'errors', 'uploaded_by')
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # throughput, eta_seconds, failure_rate
+        data.update(batch_progress(instance))
+        return data
+
 
 class BatchUploadCreateSerializer(serializers.ModelSerializer):
     file = serializers.FileField(write_only=True)
@@ -23,3 +35,42 @@ class BatchUploadCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = BatchUpload
         fields = ('file',)
+
+
+# Fast read path for item listings: the columns fetched with values_list()
+# and an encoder producing exactly what BatchItemSerializer would, without
+# building model instances or running per-field serializer machinery.
+ITEM_ROW_COLUMNS = (
+    'id', 'row_number', 'phone_number', 'amount_minor', 'status', 'result_message', 'processed_at', 'attempt_count',
+)
+
+
+def encode_item_rows(rows):
+    """Encode ``values_list(*ITEM_ROW_COLUMNS)`` tuples like ``BatchItemSerializer``."""
+    tz = timezone.get_current_timezone()
+
+    def encode_datetime(value):
+        if value is None:
+            return None
+        value = value.astimezone(tz).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    def encode_amount(minor):
+        sign = '-' if minor < 0 else ''
+        units, cents = divmod(abs(minor), AMOUNT_SCALE)
+        return f'{sign}{units}.{cents:0{AMOUNT_DECIMAL_PLACES}d}'
+
+    return [
+        {
+            'id': item_id,
+            'row_number': row_number,
+            'phone': f'+{phone_number}',
+            'amount': encode_amount(amount_minor),
+            'status': item_status,
+            'result_message': result_message,
+            'processed_at': encode_datetime(processed_at),
+            'attempt_count': attempt_count,
+        }
+        for item_id, row_number, phone_number, amount_minor, item_status, result_message, processed_at, attempt_count
+        in rows
+    ]
@@ -0,0 +1,173 @@
+"""Discrete-event simulation of the batch processing pipeline.
+
+Items flow through the same rules as the real workers -- FIFO queue, one send
+per modem at a time, lease expiry plus periodic reaping for crashed sends,
+``should_retry`` for the attempt limit and ``final_batch_status`` for the
+outcome -- but on a virtual clock, so a 300k-item batch simulates in seconds.
+"""
+import heapq
+import math
+import random
+from collections import deque
+
+from django.conf import settings
+
+from .tasks import MOCK_SEND_SECONDS, MOCK_SUCCESS_RATE, final_batch_status, should_retry
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+# Event kinds, ordered so that simultaneous events resolve deterministically
+_SEND_DONE, _REAPED = 0, 1
+
+
+def latency_sampler(rng, distribution, mean, spread):
+    """Return a function drawing send latencies (seconds) with the given mean.
+
+    ``spread`` is the relative half-width for ``uniform`` and the sigma of the
+    underlying normal for ``lognormal``; it is ignored by the other shapes.
+    """
+    if distribution == 'fixed':
+        return lambda: mean
+    if distribution == 'uniform':
+        low, high = mean * (1 - spread), mean * (1 + spread)
+        return lambda: rng.uniform(low, high)
+    if distribution == 'exponential':
+        return lambda: rng.expovariate(1 / mean)
+    if distribution == 'lognormal':
+        mu = math.log(mean) - spread ** 2 / 2
+        return lambda: rng.lognormvariate(mu, spread)
+    raise ValueError(f'Unknown latency distribution: {distribution}')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def simulate_batch(
+    items,
+    modems,
+    max_attempts=None,
+    latency=MOCK_SEND_SECONDS,
+    latency_distribution='fixed',
+    latency_spread=0.25,
+    failure_rate=1 - MOCK_SUCCESS_RATE,
+    crash_rate=0.0,
+    retry_failures=False,
+    lease_seconds=None,
+    reaper_interval=None,
+    depth_samples=20,
+    seed=None,
+):
+    """Simulate one batch and return a dict of timings and utilisation.
+
+    A failed send is final, as in ``process_batch_item``, unless
+    ``retry_failures`` is set. A crashed send (``crash_rate``) holds its item
+    until the lease expires and the next reaper run re-enqueues it. Raises
+    ValueError for a non-positive latency, a negative spread or a rate
+    outside [0, 1].
+    """
+    if max_attempts is None:
+        max_attempts = settings.BATCH_ITEM_MAX_ATTEMPTS
+    if lease_seconds is None:
+        lease_seconds = settings.BATCH_ITEM_LEASE_SECONDS
+    if reaper_interval is None:
+        reaper_interval = settings.BATCH_REAPER_INTERVAL
+    if latency <= 0:
+        raise ValueError(f'latency must be positive, got {latency}')
+    if latency_spread < 0:
+        raise ValueError(f'latency_spread must not be negative, got {latency_spread}')
+    for name, rate in (('failure_rate', failure_rate), ('crash_rate', crash_rate)):
+        if not 0 <= rate <= 1:
+            raise ValueError(f'{name} must be between 0 and 1, got {rate}')
+    if lease_seconds <= 0 or reaper_interval <= 0:
+        raise ValueError('lease_seconds and reaper_interval must be positive')
+
+    rng = random.Random(seed)
+    draw_latency = latency_sampler(rng, latency_distribution, latency, latency_spread)
+
+    queue = deque(range(items))
+    attempts = [0] * items
+    completed_at = [0.0] * items
+    events = []
+    sequence = 0
+    idle_modems = modems
+    busy_time = 0.0
+    now = 0.0
+    sends = crashes = failed = 0
+    depth_series = []
+
+    def dispatch():
+        nonlocal idle_modems, sequence, busy_time, sends, crashes
+        while idle_modems and queue:
+            item = queue.popleft()
+            idle_modems -= 1
+            attempts[item] += 1
+            sends += 1
+            duration = draw_latency()
+            busy_time += duration
+            if rng.random() < crash_rate:
+                crashes += 1
+                # the worker frees its slot on restart; the item waits for the
+                # lease to expire and for the next reaper tick after that
+                expiry = now + lease_seconds
+                reaped_at = math.ceil(expiry / reaper_interval) * reaper_interval
+                heapq.heappush(events, (now + duration, _SEND_DONE, sequence, None))
+                heapq.heappush(events, (reaped_at, _REAPED, sequence + 1, item))
+                sequence += 2
+            else:
+                heapq.heappush(events, (now + duration, _SEND_DONE, sequence, item))
+                sequence += 1
+
+    def finish(item, ok):
+        nonlocal failed
+        completed_at[item] = now
+        if not ok:
+            failed += 1
+
+    # queue depth is sampled on a grid sized from the first-order estimate
+    sample_step = max(items * latency / modems / depth_samples, latency)
+    next_sample = 0.0
+    dispatch()
+    while events:
+        when, kind, _, item = heapq.heappop(events)
+        while next_sample <= when:
+            depth_series.append((next_sample, len(queue)))
+            next_sample += sample_step
+        now = when
+
+        if kind == _SEND_DONE:
+            idle_modems += 1
+            if item is not None:
+                if rng.random() >= failure_rate:
+                    finish(item, True)
+                elif retry_failures and should_retry(attempts[item], max_attempts):
+                    queue.append(item)
+                else:
+                    finish(item, False)
+        elif should_retry(attempts[item], max_attempts):
+            queue.append(item)
+        else:
+            finish(item, False)
+        dispatch()
+    depth_series.append((now, len(queue)))
+
+    completion_times = sorted(completed_at)
+    return {
+        'items': items,
+        'modems': modems,
+        'duration': now,
+        'status': final_batch_status(failed),
+        'sends': sends,
+        'retries': sends - items,
+        'crashes': crashes,
+        'failed': failed,
+        'utilisation': busy_time / (modems * now) if now else 0.0,
+        'completion_percentiles': {
+            label: percentile(completion_times, fraction)
+            for label, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+        },
+        'queue_depth': depth_series,
+    }
@@ -2,25 +2,51 @@ import logging
 import time
 import random
 import os
-import pusher
+from collections import Counter
+from datetime import timedelta
 
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction, models
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
+from profiling.profiler import phase
+
+from .autoscale import record_send_latency
+from .control import CONTROL_CANCELLED, CONTROL_PAUSED, get_batch_control, set_batch_control
 from .models import BatchItem, BatchUpload
+from .normalize import int_to_phone
+from .progress import batch_progress, record_completion
+from .routing import queue_for_phone
 
 logger = logging.getLogger(__name__)
 
+# Simulated network/USSD processing delay and success rate
+MOCK_SEND_SECONDS = 10
+MOCK_SUCCESS_RATE = 0.9
+
+# Process-wide publisher client, built on first use (or by the worker preload
+# hook, so prefork children inherit it instead of each building their own)
+_pusher = None
+
+
 def get_pusher_client():
-    return pusher.Pusher(
-        app_id=os.environ.get("SOKETI_APP_ID", "1"),
-        key=os.environ.get("SOKETI_APP_KEY", "devkey"),
-        secret=os.environ.get("SOKETI_APP_SECRET", "devsecret"),
-        host=os.environ.get("SOKETI_HOST", "soketi"),
-        port=int(os.environ.get("SOKETI_PORT", 6001)),
-        ssl=False,
-    )
+    global _pusher
+    if _pusher is None:
+        # imported here: pusher (and requests) only matter once something is published
+        import pusher
+
+        _pusher = pusher.Pusher(
+            app_id=os.environ.get("SOKETI_APP_ID", "1"),
+            key=os.environ.get("SOKETI_APP_KEY", "devkey"),
+            secret=os.environ.get("SOKETI_APP_SECRET", "devsecret"),
+            host=os.environ.get("SOKETI_HOST", "soketi"),
+            port=int(os.environ.get("SOKETI_PORT", 6001)),
+            ssl=False,
+        )
+    return _pusher
 
 
 def _publish_item_update(item):
@@ -34,7 +60,8 @@ def _publish_item_update(item):
                 'batch': item.batch_id,
                 'row_number': item.row_number,
                 'phone': item.phone,
-                'amount': float(item.amount) if item.amount is not None else None,
+                # string like the REST API, so no precision is lost in transit
+                'amount': str(item.amount) if item.amount is not None else None,
                 'status': item.status,
                 'result_message': item.result_message,
                 'processed_at': item.processed_at.isoformat() if item.processed_at else None,
@@ -62,31 +89,194 @@ def _publish_batch_update(batch):
         logger.exception('Failed to publish batch update for batch %s', getattr(batch, 'id', None))
 
 
-@shared_task(bind=True)
-def process_batch_item(self, item_id):
+def _publish_batch_progress(batch_id):
+    """Publish a batch_progress event, at most once per progress bucket per batch."""
+    if not cache.add(f'progress-published:{batch_id}', 1, timeout=settings.BATCH_PROGRESS_BUCKET_SECONDS):
+        return
+    try:
+        batch = BatchUpload.objects.only(
+            'id', 'status', 'created_at', 'total_rows', 'processed_rows', 'errors',
+        ).get(id=batch_id)
+        _pusher_client = get_pusher_client()
+        data = {
+            'type': 'batch_progress',
+            'batch': {
+                'id': batch.id,
+                'status': batch.status,
+                'total_rows': batch.total_rows,
+                'processed_rows': batch.processed_rows,
+                'errors': batch.errors,
+                **batch_progress(batch),
+            },
+        }
+        _pusher_client.trigger(f'batches.{batch.id}', 'batch_progress', data)
+    except Exception:
+        logger.exception('Failed to publish batch progress for batch %s', batch_id)
+
+
+def enqueue_items(items, lease=None):
+    """Enqueue ``process_batch_item`` for ``(item_id, phone)`` pairs.
+
+    Each item goes to the queue of its phone prefix (see ``batch.routing``);
+    all messages are published over a single broker producer. ``lease`` is the
+    hand-off lease the reaper gave the items (see ``reap_stuck_items``).
+    """
+    kwargs = {'lease': lease.isoformat()} if lease is not None else {}
+    with process_batch_item.app.producer_or_acquire() as producer:
+        for item_id, phone in items:
+            process_batch_item.apply_async(
+                args=(item_id,), kwargs=kwargs, queue=queue_for_phone(phone), producer=producer,
+            )
+
+
+def _transition_batch(batch, allowed, new_status):
+    """Atomically move the batch to ``new_status`` if it is in one of ``allowed``."""
+    if not BatchUpload.objects.filter(id=batch.id, status__in=allowed).update(status=new_status):
+        return False
+    batch.status = new_status
+    return True
+
+
+def pause_batch(batch):
+    """Stop sending items of a running batch; queued messages become no-ops."""
+    if not _transition_batch(batch, [BatchUpload.STATUS_PROCESSING], BatchUpload.STATUS_PAUSED):
+        return False
+    set_batch_control(batch.id, CONTROL_PAUSED)
+    _publish_batch_update(batch)
+    return True
+
+
+def resume_batch(batch):
+    """Clear the pause flag and enqueue the items left pending while paused."""
+    if not _transition_batch(batch, [BatchUpload.STATUS_PAUSED], BatchUpload.STATUS_PROCESSING):
+        return False
+    set_batch_control(batch.id, None)
+    _publish_batch_update(batch)
+    pending = (
+        batch.items.filter(status=BatchItem.STATUS_PENDING)
+        .values_list('id', 'phone_number')
+        .iterator(chunk_size=settings.BATCH_REAPER_CHUNK_SIZE)
+    )
+    enqueue_items((item_id, int_to_phone(phone_number)) for item_id, phone_number in pending)
+    return True
+
+
+def cancel_batch(batch):
+    """Cancel a batch: one flag write plus one bulk UPDATE of its pending items.
+
+    No broker operation is needed; the messages still queued find their item
+    cancelled and return immediately.
+    """
+    allowed = [BatchUpload.STATUS_PENDING, BatchUpload.STATUS_PROCESSING, BatchUpload.STATUS_PAUSED]
+    if not _transition_batch(batch, allowed, BatchUpload.STATUS_CANCELLED):
+        return False
+    set_batch_control(batch.id, CONTROL_CANCELLED)
+    batch.items.filter(status=BatchItem.STATUS_PENDING).update(
+        status=BatchItem.STATUS_CANCELLED,
+        result_message='Cancelled',
+        processed_at=timezone.now(),
+    )
+    _publish_batch_update(batch)
+    return True
+
+
+def _simulate_send(item):
+    """Mock the USSD/modem round-trip, renewing the item's lease while waiting."""
+    remaining = MOCK_SEND_SECONDS
+    step = max(1, settings.BATCH_ITEM_LEASE_SECONDS // 3)
+    while remaining > 0:
+        time.sleep(min(step, remaining))
+        remaining -= step
+        if remaining > 0:
+            item.heartbeat()
+
+    # Mocked outcome: 90% success
+    return random.random() < MOCK_SUCCESS_RATE
+
+
+def should_retry(attempt_count, max_attempts=None):
+    """Whether an item that has used ``attempt_count`` attempts may be tried again."""
+    if max_attempts is None:
+        max_attempts = settings.BATCH_ITEM_MAX_ATTEMPTS
+    return attempt_count < max_attempts
+
+
+def final_batch_status(failed):
+    """Status of a batch whose items are all final, ``failed`` of them failed."""
+    return BatchUpload.STATUS_COMPLETED if failed == 0 else BatchUpload.STATUS_FAILED
+
+
+def _complete_batch_if_done(batch):
+    """Mark the batch completed/failed once every item reached a final status."""
+    total = batch.items.count()
+    finished = batch.items.filter(status__in=BatchItem.FINAL_STATUSES).count()
+    failed = batch.items.filter(status=BatchItem.STATUS_FAILED).count()
+
+    if finished >= total:
+        # final status; a cancelled batch keeps its status
+        new_status = final_batch_status(failed)
+        if BatchUpload.objects.filter(id=batch.id).exclude(status=BatchUpload.STATUS_CANCELLED).update(status=new_status):
+            batch.status = new_status
+            _publish_batch_update(batch)
+
+
+@shared_task(bind=True, acks_late=True)
+def process_batch_item(self, item_id, lease=None):
     """Process a single BatchItem.
 
     For now this simulates sending a USSD to a modem and randomly succeeds/fails.
     The real modem integration will be implemented later.
+
+    The task is acknowledged late, so it is redelivered if the worker dies;
+    the item lease keeps a redelivered copy from running alongside a live one.
+    ``lease`` (ISO timestamp) is set on messages sent by the reaper and lets
+    this message take over the item the reaper handed off under that lease.
     """
     try:
-        item = BatchItem.objects.select_related('batch').get(id=item_id)
+        with phase('load'):
+            item = BatchItem.objects.select_related('batch').get(id=item_id)
     except BatchItem.DoesNotExist:
         logger.exception("BatchItem %s does not exist", item_id)
         return
 
-    if item.status == BatchItem.STATUS_SUCCESS:
-        logger.info("BatchItem %s already succeeded", item_id)
+    if item.status in BatchItem.FINAL_STATUSES:
+        logger.info("BatchItem %s already %s", item_id, item.status)
         return
 
-    item.mark_processing()
-    _publish_item_update(item)
+    handoff = parse_datetime(lease) if lease else None
+    if item.has_active_lease() and item.lease_expires_at != handoff:
+        logger.info("BatchItem %s is leased by another worker", item_id)
+        return
+
+    # The batch row, loaded with the item, is authoritative: the cached flag
+    # is lost (or never seen) when the cache is not shared between processes.
+    # The flag is only consulted for a running batch, to catch a pause/cancel
+    # newer than the row; it is cleared before a resume re-enqueues items.
+    control = item.batch.status
+    if control not in (CONTROL_PAUSED, CONTROL_CANCELLED):
+        control = get_batch_control(item.batch_id)
+    if control == CONTROL_CANCELLED:
+        # pending items are cancelled in bulk by the cancel endpoint; this
+        # catches items that were in flight or being reaped at that moment
+        item.mark_cancelled()
+        _publish_item_update(item)
+        _complete_batch_if_done(item.batch)
+        return
+    if control == CONTROL_PAUSED:
+        # left pending; resuming the batch enqueues it again
+        logger.info("Batch %s is paused, leaving BatchItem %s pending", item.batch_id, item_id)
+        return
 
-    # Simulate network/USSD processing delay
-    time.sleep(10)
+    if not item.mark_processing(handoff_lease=handoff):
+        logger.info("BatchItem %s was claimed by another worker", item_id)
+        return
+    _publish_item_update(item)
 
-    # Mocked outcome: 90% success
-    success = random.random() < 0.9
+    started = time.monotonic()
+    with phase('send'):
+        success = _simulate_send(item)
+    queue = (self.request.delivery_info or {}).get('routing_key') or settings.BATCH_DEFAULT_QUEUE
+    record_send_latency(queue, time.monotonic() - started)
 
     if success:
         item.mark_success(message='Mocked USSD: OK')
@@ -95,17 +285,65 @@ def process_batch_item(self, item_id):
     else:
         item.mark_failed(message='Mocked USSD: FAILED')
         BatchUpload.objects.filter(id=item.batch_id).update(errors=models.F('errors') + 1)
+    record_completion(item.batch_id, failed=not success)
 
     _publish_item_update(item)
+    _publish_batch_progress(item.batch_id)
     # If all items are processed, mark the batch completed
-    batch = item.batch
-    total = batch.items.count()
-    processed = batch.items.filter(status=BatchItem.STATUS_SUCCESS).count()
-    failed = batch.items.filter(status=BatchItem.STATUS_FAILED).count()
+    with phase('complete'):
+        _complete_batch_if_done(item.batch)
+
+
+@shared_task
+def reap_stuck_items():
+    """Recover items whose worker died mid-processing.
+
+    Expired leases are found through the partial in-flight index, so the cost
+    depends on the number of stuck items rather than on the table size. Items
+    out of attempts fail. The others stay ``processing`` under a fresh
+    hand-off lease that only the message re-enqueued for them may claim; if
+    that publish is lost (or this process dies first) the lease expires again
+    and the next run retries it, so no item is left without a message.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        stuck = list(
+            BatchItem.objects
+            .filter(status=BatchItem.STATUS_PROCESSING, lease_expires_at__lt=now)
+            .order_by('lease_expires_at')
+            .select_for_update(skip_locked=True)
+            .values_list('id', 'batch_id', 'attempt_count', 'phone_number')[:settings.BATCH_REAPER_CHUNK_SIZE]
+        )
+        if not stuck:
+            return 0
+
+        retry = [
+            (item_id, int_to_phone(phone_number))
+            for item_id, _, attempts, phone_number in stuck
+            if should_retry(attempts)
+        ]
+        exhausted = Counter(batch_id for _, batch_id, attempts, _ in stuck if not should_retry(attempts))
+
+        handoff = now + timedelta(seconds=settings.BATCH_ITEM_LEASE_SECONDS)
+        if retry:
+            BatchItem.objects.filter(id__in=[item_id for item_id, _ in retry]).update(
+                lease_expires_at=handoff,
+            )
+        if exhausted:
+            BatchItem.objects.filter(
+                id__in=[item_id for item_id, _, attempts, _ in stuck if not should_retry(attempts)],
+            ).update(
+                status=BatchItem.STATUS_FAILED,
+                result_message='Lease expired after %d attempts' % settings.BATCH_ITEM_MAX_ATTEMPTS,
+                processed_at=now,
+                lease_expires_at=None,
+            )
+            for batch_id, count in exhausted.items():
+                BatchUpload.objects.filter(id=batch_id).update(errors=models.F('errors') + count)
+                record_completion(batch_id, failed=True, count=count)
 
-    if processed + failed >= total:
-        # final status
-        new_status = BatchUpload.STATUS_COMPLETED if failed == 0 else BatchUpload.STATUS_FAILED
-        batch.status = new_status
-        batch.save(update_fields=['status'])
-        _publish_batch_update(batch)
+    logger.warning('Reaped %d stuck items (%d re-enqueued)', len(stuck), len(retry))
+    enqueue_items(retry, lease=handoff)
+    for batch in BatchUpload.objects.filter(id__in=list(exhausted)):
+        _complete_batch_if_done(batch)
+    return len(stuck)
@@ -1,9 +1,37 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
 from django.urls import reverse
+from django.test import override_settings
 from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth import get_user_model
 from .models import BatchUpload, BatchItem
+from .tasks import _publish_batch_progress, enqueue_items, process_batch_item, reap_stuck_items
+from .routing import queue_for_phone
+from .normalize import int_to_phone, phone_prefix_ranges, phone_to_int, to_minor_units
+from . import control
+from .simulation import simulate_batch
+from .progress import batch_progress, progress_stats, record_completion
+from .serializers import ITEM_ROW_COLUMNS, BatchItemSerializer, encode_item_rows
+from .autoscale import (
+    QueueDepthAutoscaler, desired_concurrency, queue_depths, record_send_latency, scaling_decisions,
+    send_latency,
+)
 from decimal import Decimal
 from django.utils import timezone
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
+from datetime import timedelta
 
 User = get_user_model()
 
@@ -62,3 +90,764 @@ class BatchItemListTests(APITestCase):
         client.force_authenticate(user=self.other)
         resp2 = client.get(url)
         self.assertEqual(resp2.status_code, 200)
+
+
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        from payflow import db_routers
+        self.db_routers = db_routers
+        db_routers._lag_cache.clear()
+        cache.clear()
+        self.router = db_routers.PrimaryReplicaRouter()
+        self.user = User.objects.create_user(username='carol', password='password')
+        self.batch = BatchUpload.objects.create(original_filename='test.xlsx', uploaded_by=self.user)
+        # declare a second (SQLite) database as the replica stand-in
+        replica = {**connections.settings['default'], 'NAME': ':memory:'}
+        patcher = mock.patch.dict(connections.settings, {'replica': replica})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _read_with_replica_allowed(self):
+        token = self.db_routers._replica_reads.set(True)
+        try:
+            return self.router.db_for_read(BatchItem)
+        finally:
+            self.db_routers._replica_reads.reset(token)
+
+    def test_reads_outside_read_views_use_primary(self):
+        self.assertIsNone(self.router.db_for_read(BatchItem))
+        self.assertEqual(self.router.db_for_write(BatchItem), 'default')
+
+    def test_read_view_uses_replica_when_lag_is_low(self):
+        self.assertEqual(self._read_with_replica_allowed(), 'replica')
+
+    def test_falls_back_to_primary_when_lag_exceeds_threshold(self):
+        with mock.patch.object(self.db_routers, '_measure_lag', return_value=60.0):
+            self.assertEqual(self._read_with_replica_allowed(), 'default')
+
+    def test_falls_back_to_primary_when_lag_cannot_be_measured(self):
+        with mock.patch.object(self.db_routers, '_measure_lag', side_effect=RuntimeError('down')), \
+                self.assertLogs('payflow.db_routers', level='ERROR'):
+            self.assertEqual(self._read_with_replica_allowed(), 'default')
+
+    def test_replica_is_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'batch'))
+        self.assertIsNone(self.router.allow_migrate('default', 'batch'))
+
+    def test_uploader_is_pinned_to_primary_after_write(self):
+        url = reverse('batch-items-list', kwargs={'batch_id': self.batch.id})
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        with mock.patch.object(self.db_routers, 'replica_alias', return_value=None) as alias:
+            client.get(url)
+            self.assertTrue(alias.called)
+
+        self.db_routers.pin_to_primary(self.user)
+        with mock.patch.object(self.db_routers, 'replica_alias', return_value=None) as alias:
+            resp = client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertFalse(alias.called)
+
+
+class ReplicaReadTests(APITestCase):
+    """Reads against a second SQLite database standing in for the replica."""
+
+    def _add_replica(self):
+        # A fresh in-memory database per test, outside the test transaction;
+        # the router never migrates the replica, so the tables are built by hand.
+        patcher = mock.patch.dict(
+            connections.settings, {'replica': {**connections.settings['default'], 'NAME': ':memory:'}},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(delattr, connections._connections, 'replica')
+        self.addCleanup(lambda: connections['replica'].close())
+        with connections['replica'].schema_editor() as editor:
+            for model in (User, BatchUpload, BatchItem):
+                editor.create_model(model)
+
+    def setUp(self):
+        self._add_replica()
+        from payflow import db_routers
+        self.db_routers = db_routers
+        db_routers._lag_cache.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='erin', password='password')
+        self.batch = BatchUpload.objects.create(original_filename='test.xlsx', uploaded_by=self.user)
+        BatchItem.objects.create(batch=self.batch, row_number=1, phone='+261340000001', amount='1.00')
+        BatchItem.objects.create(batch=self.batch, row_number=2, phone='+261340000002', amount='1.00')
+        # the replica has not caught up with row 2 yet
+        self.user.save(using='replica', force_insert=True)
+        self.batch.save(using='replica', force_insert=True)
+        BatchItem.objects.using('replica').create(
+            batch_id=self.batch.id, row_number=1, phone='+261340000001', amount='1.00',
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('batch-items-list', kwargs={'batch_id': self.batch.id})
+
+    def _rows(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        return [r['row_number'] for r in resp.data['results']]
+
+    def test_read_view_reads_from_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.assertEqual(self._rows(), [1])
+        self.assertTrue(replica_queries.captured_queries)
+
+    def test_pinned_user_reads_own_writes_from_primary(self):
+        self.db_routers.pin_to_primary(self.user)
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.assertEqual(self._rows(), [1, 2])
+        self.assertFalse(replica_queries.captured_queries)
+
+    @mock.patch('batch.views.enqueue_items')
+    def test_upload_pins_after_items_are_committed(self, enqueue):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(['phone', 'amount'])
+        workbook.active.append(['+261341234567', 10])
+        content = io.BytesIO()
+        workbook.save(content)
+        upload = SimpleUploadedFile('upload.xlsx', content.getvalue())
+
+        items_when_pinned = []
+        pin = lambda user: items_when_pinned.append(BatchItem.objects.exclude(batch=self.batch).count())
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch('batch.views.pin_to_primary', side_effect=pin):
+            resp = self.client.post(reverse('batch-upload-create'), {'file': upload}, format='multipart')
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(items_when_pinned, [1])
+
+
+@mock.patch('batch.tasks._publish_batch_progress')
+@mock.patch('batch.tasks._publish_batch_update')
+@mock.patch('batch.tasks._publish_item_update')
+class StuckItemRecoveryTests(APITestCase):
+    def setUp(self):
+        self.batch = BatchUpload.objects.create(original_filename='test.xlsx', status=BatchUpload.STATUS_PROCESSING)
+        past = timezone.now() - timedelta(minutes=5)
+        future = timezone.now() + timedelta(minutes=5)
+        self.expired = BatchItem.objects.create(
+            batch=self.batch, row_number=1, phone='+261340000001', amount=Decimal('1.00'),
+            status=BatchItem.STATUS_PROCESSING, attempt_count=1, lease_expires_at=past,
+        )
+        self.exhausted = BatchItem.objects.create(
+            batch=self.batch, row_number=2, phone='+261340000002', amount=Decimal('1.00'),
+            status=BatchItem.STATUS_PROCESSING, attempt_count=3, lease_expires_at=past,
+        )
+        self.active = BatchItem.objects.create(
+            batch=self.batch, row_number=3, phone='+261340000003', amount=Decimal('1.00'),
+            status=BatchItem.STATUS_PROCESSING, attempt_count=1, lease_expires_at=future,
+        )
+
+    @mock.patch('batch.tasks.enqueue_items')
+    def test_reaper_requeues_expired_and_fails_exhausted(self, enqueue, *_):
+        with self.assertLogs('batch.tasks', level='WARNING'):
+            reaped = reap_stuck_items()
+
+        self.assertEqual(reaped, 2)
+        self.expired.refresh_from_db()
+        self.exhausted.refresh_from_db()
+        self.active.refresh_from_db()
+        # handed off under a fresh lease that the re-enqueued message carries
+        self.assertEqual(self.expired.status, BatchItem.STATUS_PROCESSING)
+        self.assertGreater(self.expired.lease_expires_at, timezone.now())
+        enqueue.assert_called_once_with(
+            [(self.expired.id, self.expired.phone)], lease=self.expired.lease_expires_at,
+        )
+        self.assertEqual(self.exhausted.status, BatchItem.STATUS_FAILED)
+        self.assertEqual(self.active.status, BatchItem.STATUS_PROCESSING)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.errors, 1)
+
+    @mock.patch('batch.tasks.enqueue_items')
+    def test_reaper_is_noop_without_expired_leases(self, enqueue, *_):
+        BatchItem.objects.filter(lease_expires_at__lt=timezone.now()).delete()
+        self.assertEqual(reap_stuck_items(), 0)
+        enqueue.assert_not_called()
+
+    @mock.patch('batch.tasks._simulate_send')
+    def test_redelivered_task_skips_item_with_active_lease(self, send, *_):
+        process_batch_item.run(self.active.id)
+        send.assert_not_called()
+
+    @mock.patch('batch.tasks._simulate_send', return_value=True)
+    def test_only_the_handoff_message_claims_a_reaped_item(self, send, *_):
+        with mock.patch('batch.tasks.enqueue_items') as enqueue, self.assertLogs('batch.tasks', level='WARNING'):
+            reap_stuck_items()
+        lease = enqueue.call_args.kwargs['lease']
+
+        # a stale redelivery of the crashed worker's message
+        process_batch_item.run(self.expired.id)
+        send.assert_not_called()
+
+        process_batch_item.run(self.expired.id, lease=lease.isoformat())
+        send.assert_called_once()
+        self.expired.refresh_from_db()
+        self.assertEqual(self.expired.status, BatchItem.STATUS_SUCCESS)
+
+    def test_lost_requeue_is_retried_by_the_next_run(self, *_):
+        with mock.patch('batch.tasks.enqueue_items', side_effect=ConnectionError('broker down')), \
+                self.assertLogs('batch.tasks', level='WARNING'), self.assertRaises(ConnectionError):
+            reap_stuck_items()
+        self.expired.refresh_from_db()
+        self.assertEqual(self.expired.status, BatchItem.STATUS_PROCESSING)
+
+        # once the hand-off lease runs out, the item is picked up again
+        BatchItem.objects.filter(id=self.expired.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        with mock.patch('batch.tasks.enqueue_items') as enqueue, self.assertLogs('batch.tasks', level='WARNING'):
+            reap_stuck_items()
+        self.assertEqual(enqueue.call_args.args[0], [(self.expired.id, self.expired.phone)])
+
+    @mock.patch('batch.tasks._simulate_send', return_value=True)
+    def test_processing_releases_lease(self, send, *_):
+        process_batch_item.run(self.expired.id)
+        self.expired.refresh_from_db()
+        self.assertEqual(self.expired.status, BatchItem.STATUS_SUCCESS)
+        self.assertEqual(self.expired.attempt_count, 2)
+        self.assertIsNone(self.expired.lease_expires_at)
+
+
+@override_settings(
+    BATCH_DEFAULT_QUEUE='celery',
+    BATCH_PHONE_PREFIX_QUEUES={'+261': 'batch.mg', '+26132': 'batch.orange'},
+)
+class QueueRoutingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_longest_prefix_wins(self):
+        self.assertEqual(queue_for_phone('+261 32 11 222 33'), 'batch.orange')
+        self.assertEqual(queue_for_phone('+261341122233'), 'batch.mg')
+        self.assertEqual(queue_for_phone('+33612345678'), 'celery')
+
+    def test_reaper_runs_on_the_default_queue(self):
+        # operator queues may have no consumer; the default queue always does
+        reaper = settings.CELERY_BEAT_SCHEDULE['reap-stuck-batch-items']
+        self.assertEqual(reaper['options']['queue'], settings.BATCH_DEFAULT_QUEUE)
+
+    def test_enqueue_routes_each_item_to_its_queue(self):
+        with mock.patch.object(process_batch_item, 'apply_async') as apply_async, \
+                mock.patch.object(process_batch_item.app, 'producer_or_acquire', mock.MagicMock()):
+            enqueue_items([(1, '+261321112233'), (2, '+33612345678')])
+        queues = [call.kwargs['queue'] for call in apply_async.call_args_list]
+        self.assertEqual(queues, ['batch.orange', 'celery'])
+
+    def test_desired_concurrency_follows_backlog_and_latency(self):
+        # 120 queued items at 10s each drain in 120s with 10 processes
+        self.assertEqual(desired_concurrency([(120, 10.0)], 0, 1, 40, 120), 10)
+        self.assertEqual(desired_concurrency([(120, 10.0)], 2, 1, 40, 120), 12)
+        self.assertEqual(desired_concurrency([(10000, 10.0)], 0, 1, 40, 120), 40)
+        self.assertEqual(desired_concurrency([(0, 10.0)], 0, 1, 40, 120), 1)
+        self.assertEqual(desired_concurrency([(None, None)], 0, 2, 40, 120), 2)
+        # backlogs of several queues add up; reserved tasks count once
+        self.assertEqual(desired_concurrency([(48, 10.0), (48, 10.0)], 1, 1, 40, 120), 9)
+
+    def test_autoscaler_scales_to_queue_backlog_and_records_decision(self):
+        worker = mock.Mock(hostname='worker@orange')
+        worker.app.amqp.queues.consume_from = {'batch.orange': None, 'batch.telma': None}
+        scaler = QueueDepthAutoscaler(mock.Mock(num_processes=1), 40, 1, worker=worker)
+        record_send_latency('batch.orange', 10.0)
+        record_send_latency('batch.telma', 10.0)
+        depths = {'batch.orange': 120, 'batch.telma': 48}
+        with mock.patch('batch.autoscale.queue_depths', return_value=depths) as queue_depths:
+            self.assertEqual(scaler.qty, 14)
+        queue_depths.assert_called_once_with(worker.app, ['batch.orange', 'batch.telma'])
+        decision = scaling_decisions(['batch.orange'])['batch.orange']
+        self.assertEqual(decision['depth'], 120)
+        self.assertEqual(decision['backlog_processes'], 10)
+        self.assertEqual(decision['desired'], 14)
+
+    def test_emptied_queue_has_zero_depth(self):
+        from kombu.exceptions import ChannelError
+
+        missing = ChannelError("NOT_FOUND - no queue 'batch.telma'", (50, 10), 'Channel.queue_declare', '404')
+        app = mock.MagicMock()
+        conn = app.connection_for_read.return_value.__enter__.return_value
+        conn.channel.return_value.queue_declare.side_effect = [mock.Mock(message_count=3), missing]
+        self.assertEqual(queue_depths(app, ['batch.orange', 'batch.telma']), {'batch.orange': 3, 'batch.telma': 0})
+        app.connection_for_read.assert_called_once_with()
+
+        conn.channel.return_value.queue_declare.side_effect = RuntimeError('broker down')
+        with self.assertLogs('batch.autoscale', level='ERROR'):
+            self.assertEqual(queue_depths(app, ['batch.orange']), {'batch.orange': None})
+
+    def test_send_latency_is_a_moving_average(self):
+        record_send_latency('batch.orange', 10.0)
+        record_send_latency('batch.orange', 20.0)
+        self.assertAlmostEqual(send_latency('batch.orange'), 12.0)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        url = reverse('batch-queue-metrics')
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(username='dave', password='password'))
+        self.assertEqual(client.get(url).status_code, 403)
+
+        admin = User.objects.create_user(username='erin', password='password', is_staff=True)
+        client.force_authenticate(user=admin)
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([q['queue'] for q in resp.data['queues']], ['celery', 'batch.mg', 'batch.orange'])
+
+
+class CompactStorageTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='frank', password='password')
+        self.batch = BatchUpload.objects.create(original_filename='test.xlsx', uploaded_by=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('batch-items-list', kwargs={'batch_id': self.batch.id})
+
+    def test_amounts_are_exact_minor_units(self):
+        self.assertEqual(to_minor_units(10.1), 1010)
+        self.assertEqual(to_minor_units('0.29'), 29)
+        self.assertEqual(to_minor_units(Decimal('1.005')), 101)
+        self.assertEqual(to_minor_units(7), 700)
+        with self.assertRaises(ValueError):
+            to_minor_units('abc')
+
+    @override_settings(PHONE_DEFAULT_COUNTRY_CODE='261')
+    def test_phones_are_normalised_to_e164(self):
+        self.assertEqual(phone_to_int('+261 34 12-345-67'), 261341234567)
+        self.assertEqual(phone_to_int('00261341234567'), 261341234567)
+        self.assertEqual(phone_to_int('0341234567'), 261341234567)
+        self.assertEqual(phone_to_int(261341234567.0), 261341234567)
+        # numeric cells drop the trunk 0 of national numbers
+        self.assertEqual(phone_to_int(341234567), 261341234567)
+        self.assertEqual(phone_to_int(341234567.0), 261341234567)
+        self.assertEqual(phone_to_int(33612345678), 33612345678)
+        with override_settings(BATCH_PHONE_PREFIX_QUEUES={'+26132': 'batch.orange'}):
+            self.assertEqual(queue_for_phone(int_to_phone(phone_to_int(321234567))), 'batch.orange')
+        for invalid in ('abc', '+12', '+0123456789', '+1234567890123456'):
+            with self.assertRaises(ValueError):
+                phone_to_int(invalid)
+
+    def test_model_properties_keep_existing_api(self):
+        item = BatchItem.objects.create(batch=self.batch, row_number=1, phone='+261 34 12 345 67', amount='12.30')
+        item.refresh_from_db()
+        self.assertEqual(item.phone_number, 261341234567)
+        self.assertEqual(item.phone, '+261341234567')
+        self.assertEqual(item.amount_minor, 1230)
+        self.assertEqual(item.amount, Decimal('12.30'))
+
+    def test_listing_response_shape_and_filters(self):
+        BatchItem.objects.create(batch=self.batch, row_number=1, phone='+261341234567', amount='12.30')
+        BatchItem.objects.create(batch=self.batch, row_number=2, phone='+261329876543', amount='5.00')
+
+        resp = self.client.get(self.url, {'ordering': '-amount'})
+        self.assertEqual(resp.status_code, 200)
+        first = resp.data['results'][0]
+        self.assertEqual(first['phone'], '+261341234567')
+        self.assertEqual(first['amount'], '12.30')
+
+        resp = self.client.get(self.url, {'phone': '+261 32 98 765 43'})
+        self.assertEqual([r['row_number'] for r in resp.data['results']], [2])
+
+        # partial numbers still match as a substring
+        resp = self.client.get(self.url, {'phone': '4123'})
+        self.assertEqual([r['row_number'] for r in resp.data['results']], [1])
+
+        # long fragments too, even though they would parse as a full number
+        for fragment in ('41234567', '341234567', '1234567'):
+            resp = self.client.get(self.url, {'phone': fragment})
+            self.assertEqual([r['row_number'] for r in resp.data['results']], [1], fragment)
+
+        # full numbers and prefixes, international or national format
+        for number in ('261341234567', '0341234567', '034', '0341234', '+26134123', '+261341234',
+                       '00261341234567', '+261 34 12 345 67'):
+            resp = self.client.get(self.url, {'phone': number})
+            self.assertEqual([r['row_number'] for r in resp.data['results']], [1], number)
+
+        for number in ('+33', '0331234', '+'):
+            resp = self.client.get(self.url, {'phone': number})
+            self.assertEqual(resp.data['results'], [], number)
+
+        resp = self.client.get(self.url, {'min_amount': '6', 'max_amount': 'oops'})
+        self.assertEqual([r['row_number'] for r in resp.data['results']], [1])
+
+
+@mock.patch('batch.tasks._publish_batch_progress')
+@mock.patch('batch.tasks._publish_batch_update')
+@mock.patch('batch.tasks._publish_item_update')
+class BatchControlTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        control._local_flags.clear()
+        self.user = User.objects.create_user(username='grace', password='password')
+        self.batch = BatchUpload.objects.create(
+            original_filename='test.xlsx', uploaded_by=self.user, status=BatchUpload.STATUS_PROCESSING,
+        )
+        self.items = [
+            BatchItem.objects.create(batch=self.batch, row_number=i, phone=f'+26134000000{i}', amount='1.00')
+            for i in range(1, 4)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def _post(self, name):
+        return self.client.post(reverse(name, kwargs={'pk': self.batch.id}))
+
+    @mock.patch('batch.tasks._simulate_send')
+    def test_paused_batch_leaves_items_pending(self, send, *_):
+        resp = self._post('batch-pause')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['status'], BatchUpload.STATUS_PAUSED)
+
+        process_batch_item.run(self.items[0].id)
+        send.assert_not_called()
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].status, BatchItem.STATUS_PENDING)
+
+    @mock.patch('batch.tasks._simulate_send')
+    def test_paused_status_wins_without_shared_flag(self, send, *_):
+        # e.g. a per-process cache: the worker never sees the web process' flag
+        self._post('batch-pause')
+        cache.clear()
+        control._local_flags.clear()
+
+        process_batch_item.run(self.items[0].id)
+        send.assert_not_called()
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].status, BatchItem.STATUS_PENDING)
+
+    @mock.patch('batch.tasks._simulate_send')
+    def test_cancelled_status_wins_without_shared_flag(self, send, *_):
+        BatchUpload.objects.filter(id=self.batch.id).update(status=BatchUpload.STATUS_CANCELLED)
+
+        process_batch_item.run(self.items[0].id)
+        send.assert_not_called()
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].status, BatchItem.STATUS_CANCELLED)
+
+    @mock.patch('batch.tasks.enqueue_items')
+    def test_resume_enqueues_pending_items(self, enqueue, *_):
+        self._post('batch-pause')
+        self.items[0].mark_success('done')
+
+        resp = self._post('batch-resume')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['status'], BatchUpload.STATUS_PROCESSING)
+        self.assertIsNone(control.get_batch_control(self.batch.id))
+        self.assertEqual(
+            list(enqueue.call_args.args[0]),
+            [(item.id, item.phone) for item in self.items[1:]],
+        )
+
+    @mock.patch('batch.tasks.enqueue_items')
+    @mock.patch('batch.tasks._simulate_send', return_value=True)
+    def test_items_enqueued_by_resume_are_sent(self, send, enqueue, *_):
+        # a worker process that drained messages during the pause
+        worker_flags = {}
+        self._post('batch-pause')
+        with mock.patch.object(control, '_local_flags', worker_flags):
+            self.assertEqual(control.get_batch_control(self.batch.id), control.CONTROL_PAUSED)
+            process_batch_item.run(self.items[0].id)
+        send.assert_not_called()
+
+        # resumed from the web process, within the worker's local TTL
+        with mock.patch.object(control, '_local_flags', {}):
+            self._post('batch-resume')
+        with mock.patch.object(control, '_local_flags', worker_flags):
+            process_batch_item.run(self.items[0].id)
+        send.assert_called_once()
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].status, BatchItem.STATUS_SUCCESS)
+
+    @mock.patch('batch.tasks._simulate_send')
+    def test_cancel_marks_pending_items_in_bulk(self, send, *_):
+        self.items[0].mark_processing()
+
+        with self.assertNumQueries(4):
+            # batch + uploader lookup, status transition, one bulk item update
+            resp = self._post('batch-cancel')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            list(BatchItem.objects.filter(batch=self.batch).values_list('status', flat=True)),
+            [BatchItem.STATUS_PROCESSING, BatchItem.STATUS_CANCELLED, BatchItem.STATUS_CANCELLED],
+        )
+
+        # queued messages for cancelled items are no-ops
+        process_batch_item.run(self.items[1].id)
+        send.assert_not_called()
+
+    @mock.patch('batch.tasks._simulate_send', return_value=True)
+    def test_completion_keeps_cancelled_status(self, send, *_):
+        self._post('batch-cancel')
+        BatchItem.objects.filter(id=self.items[0].id).update(status=BatchItem.STATUS_PENDING)
+        control._local_flags.clear()
+        control.set_batch_control(self.batch.id, None)
+
+        process_batch_item.run(self.items[0].id)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, BatchUpload.STATUS_CANCELLED)
+
+    def test_invalid_transitions_conflict(self, *_):
+        self.assertEqual(self._post('batch-resume').status_code, 409)
+        self.assertEqual(self._post('batch-cancel').status_code, 200)
+        self.assertEqual(self._post('batch-pause').status_code, 409)
+
+    def test_other_user_cannot_control_batch(self, *_):
+        self.client.force_authenticate(user=User.objects.create_user(username='heidi', password='password'))
+        self.assertEqual(self._post('batch-cancel').status_code, 403)
+
+
+class BatchItemAdminTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='ivan', password='password')
+        self.batch = BatchUpload.objects.create(original_filename='test.xlsx', uploaded_by=self.admin)
+        self.other_batch = BatchUpload.objects.create(original_filename='other.xlsx', uploaded_by=self.admin)
+        BatchItem.objects.create(batch=self.batch, row_number=1, phone='+261341234567', amount='1.00')
+        BatchItem.objects.create(batch=self.batch, row_number=2, phone='+261329876543', amount='1.00')
+        BatchItem.objects.create(batch=self.other_batch, row_number=1, phone='+33612345678', amount='1.00')
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:batch_batchitem_changelist')
+
+    def test_phone_prefix_ranges(self):
+        self.assertEqual(phone_prefix_ranges('+2613412345678'), [
+            (2613412345678, 2613412345679),
+            (26134123456780, 26134123456790),
+            (261341234567800, 261341234567900),
+        ])
+        self.assertEqual(len(phone_prefix_ranges('+261')), 8)
+        self.assertEqual(phone_prefix_ranges('abc'), [])
+
+    def test_search_by_phone_prefix(self):
+        resp = self.client.get(self.url, {'q': '+26134'})
+        self.assertEqual(resp.context['cl'].result_count, 1)
+        resp = self.client.get(self.url, {'q': '+261'})
+        self.assertEqual(resp.context['cl'].result_count, 2)
+        resp = self.client.get(self.url, {'q': '+33 6 12 34 56 78'})
+        self.assertEqual(resp.context['cl'].result_count, 1)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+        for i in range(2, 30):
+            BatchItem.objects.create(batch=self.other_batch, row_number=i, phone=f'+3361234{i:04d}', amount='1.00')
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(self.url)
+        self.assertEqual(len(small), len(large))
+
+    def test_date_hierarchy_only_within_a_batch(self):
+        resp = self.client.get(self.url)
+        self.assertIsNone(resp.context['cl'].date_hierarchy)
+        resp = self.client.get(self.url, {'batch': self.batch.id})
+        self.assertEqual(resp.context['cl'].date_hierarchy, 'processed_at')
+        self.assertEqual(resp.context['cl'].result_count, 2)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=1000)
+    def test_large_tables_use_estimated_count(self):
+        with mock.patch('batch.pagination.estimated_row_count', return_value=10_000_000):
+            resp = self.client.get(self.url)
+        self.assertEqual(resp.context['cl'].result_count, 10_000_000)
+
+        # small estimates are counted exactly
+        with mock.patch('batch.pagination.estimated_row_count', return_value=10):
+            resp = self.client.get(self.url)
+        self.assertEqual(resp.context['cl'].result_count, 3)
+
+
+class ItemListingFastPathTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='peggy', password='password')
+        self.batch = BatchUpload.objects.create(original_filename='test.xlsx', uploaded_by=self.user)
+        BatchItem.objects.create(batch=self.batch, row_number=1, phone='+261341234567', amount='12.30')
+        BatchItem.objects.create(
+            batch=self.batch, row_number=2, phone='+261329876543', amount='0.05',
+            status=BatchItem.STATUS_SUCCESS, result_message='ok', processed_at=timezone.now(), attempt_count=1,
+        )
+        BatchItem.objects.create(batch=self.batch, row_number=3, phone='+33612345678', amount='-7.00')
+
+    def test_encoder_matches_model_serializer(self):
+        items = BatchItem.objects.filter(batch=self.batch)
+        expected = [dict(row) for row in BatchItemSerializer(items, many=True).data]
+        self.assertEqual(encode_item_rows(items.values_list(*ITEM_ROW_COLUMNS)), expected)
+
+    def test_listing_renders_json_with_orjson(self):
+        self.client.force_authenticate(user=self.user)
+        resp = self.client.get(reverse('batch-items-list', kwargs={'batch_id': self.batch.id}))
+        self.assertEqual(resp['Content-Type'], 'application/json')
+        body = json.loads(resp.content)
+        self.assertEqual(body['count'], 3)
+        self.assertEqual([r['amount'] for r in body['results']], ['12.30', '0.05', '-7.00'])
+
+    def test_benchmark_command_reports_rows_per_second(self):
+        out = io.StringIO()
+        call_command('benchmark_item_serialization', rows=50, repeat=1, stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+
+
+class SimulationTests(APITestCase):
+    def test_fixed_latency_matches_closed_form(self):
+        result = simulate_batch(400, 40, latency=10, failure_rate=0, seed=1)
+        self.assertAlmostEqual(result['duration'], 100)
+        self.assertAlmostEqual(result['utilisation'], 1.0)
+        self.assertEqual(result['status'], BatchUpload.STATUS_COMPLETED)
+        self.assertEqual(result['completion_percentiles']['p50'], 50)
+        self.assertEqual(result['queue_depth'][0], (0.0, 360))
+        self.assertEqual(result['queue_depth'][-1], (100, 0))
+
+    def test_failures_are_final_unless_retried(self):
+        result = simulate_batch(100, 10, failure_rate=1.0, seed=1)
+        self.assertEqual((result['failed'], result['retries']), (100, 0))
+        self.assertEqual(result['status'], BatchUpload.STATUS_FAILED)
+
+        result = simulate_batch(100, 10, max_attempts=4, failure_rate=1.0, retry_failures=True, seed=1)
+        self.assertEqual((result['failed'], result['retries']), (100, 300))
+
+    def test_crashed_sends_wait_for_lease_and_reaper(self):
+        result = simulate_batch(
+            1, 1, max_attempts=2, latency=10, failure_rate=0, crash_rate=1.0,
+            lease_seconds=60, reaper_interval=30, seed=1,
+        )
+        # two crashed attempts: reaped at t=60 and t=120, then out of attempts
+        self.assertEqual(result['crashes'], 2)
+        self.assertEqual(result['duration'], 120)
+        self.assertEqual(result['failed'], 1)
+
+    def test_invalid_parameters_are_rejected(self):
+        for kwargs in (
+            {'latency': 0},
+            {'latency': -1, 'latency_distribution': 'lognormal'},
+            {'latency': 0, 'latency_distribution': 'exponential'},
+            {'latency_spread': -0.1},
+            {'failure_rate': 1.5},
+            {'crash_rate': -0.1},
+        ):
+            with self.assertRaises(ValueError, msg=kwargs):
+                simulate_batch(10, 2, **kwargs)
+
+        for options in ({'latency': 0}, {'latency_spread': -1}, {'failure_rate': 2}, {'crash_rate': -1}):
+            with self.assertRaises(CommandError, msg=options):
+                call_command('simulate_batch', items=10, modems=2, stdout=io.StringIO(), **options)
+
+    def test_simulate_batch_command(self):
+        out = io.StringIO()
+        call_command('simulate_batch', items=1000, modems=4, retries=2, runs=2, seed=3, stdout=out)
+        output = out.getvalue()
+        self.assertIn('Batch completion over 2 runs', output)
+        self.assertIn('Modem utilisation', output)
+
+
+@override_settings(BATCH_PROGRESS_BUCKET_SECONDS=5, BATCH_PROGRESS_WINDOW_BUCKETS=24, BATCH_PROGRESS_HALF_LIFE=30)
+class BatchProgressTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='rupert', password='password')
+        self.batch = BatchUpload.objects.create(
+            original_filename='test.xlsx', uploaded_by=self.user, status=BatchUpload.STATUS_PROCESSING,
+            total_rows=1000, processed_rows=380, errors=20,
+        )
+
+    def _record_steady_rate(self, batch_id, now, per_bucket=10, failed_per_bucket=1, buckets=24):
+        for age in range(1, buckets + 1):
+            at = now - age * 5
+            record_completion(batch_id, count=per_bucket - failed_per_bucket, now=at)
+            record_completion(batch_id, failed=True, count=failed_per_bucket, now=at)
+
+    def test_steady_rate_gives_throughput_and_eta(self):
+        now = 1_000_000.0
+        self._record_steady_rate(self.batch.id, now)
+        stats = progress_stats(self.batch.id, remaining=600, now=now)
+        self.assertAlmostEqual(stats['throughput'], 2.0)
+        self.assertAlmostEqual(stats['eta_seconds'], 300.0)
+        self.assertAlmostEqual(stats['failure_rate'], 0.1)
+
+    def test_recent_buckets_weigh_more(self):
+        now = 1_000_000.0
+        # slow a minute ago, fast in the last 30 seconds
+        for age in range(1, 13):
+            record_completion(self.batch.id, count=20 if age <= 6 else 2, now=now - age * 5)
+        stats = progress_stats(self.batch.id, remaining=100, now=now, started_at=now - 60)
+        self.assertGreater(stats['throughput'], (20 * 6 + 2 * 6) / 60)
+
+    def test_no_history_means_no_eta(self):
+        stats = progress_stats(self.batch.id, remaining=100)
+        self.assertEqual(stats, {'throughput': 0.0, 'eta_seconds': None, 'failure_rate': None})
+        self.assertEqual(progress_stats(self.batch.id, remaining=0)['eta_seconds'], 0.0)
+
+    def test_detail_api_exposes_progress_without_item_queries(self):
+        BatchUpload.objects.filter(id=self.batch.id).update(created_at=timezone.now() - timedelta(minutes=5))
+        self._record_steady_rate(self.batch.id, time.time())
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('batch-upload-detail', kwargs={'pk': self.batch.id}))
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(resp.data['throughput'], 0)
+        self.assertIsNotNone(resp.data['eta_seconds'])
+        self.assertIn('failure_rate', resp.data)
+        self.assertFalse(any('batch_batchitem' in q['sql'] for q in queries.captured_queries))
+
+    def test_paused_batch_has_no_eta(self):
+        self._record_steady_rate(self.batch.id, time.time())
+        self.batch.status = BatchUpload.STATUS_PAUSED
+        self.assertIsNone(batch_progress(self.batch)['eta_seconds'])
+
+    @mock.patch('batch.tasks.get_pusher_client')
+    def test_progress_events_are_throttled(self, get_client):
+        _publish_batch_progress(self.batch.id)
+        _publish_batch_progress(self.batch.id)
+        trigger = get_client.return_value.trigger
+        trigger.assert_called_once()
+        channel, event, data = trigger.call_args.args
+        self.assertEqual((channel, event), (f'batches.{self.batch.id}', 'batch_progress'))
+        self.assertEqual(data['batch']['processed_rows'], 380)
+        self.assertIn('eta_seconds', data['batch'])
+
+
+class StartupTests(APITestCase):
+    # Heavy modules that web and worker processes only import on first use
+    LAZY_MODULES = ('openpyxl', 'pusher')
+
+    def importtime(self, statement):
+        """Run ``statement`` in a fresh interpreter under ``-X importtime``.
+
+        Returns {module: cumulative microseconds}.
+        """
+        code = f'import django; django.setup(); {statement}'
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'payflow.settings'}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, module = line[len('import time:'):].split('|')
+            times[module.strip()] = int(cumulative)
+        return times
+
+    def test_worker_and_web_imports_skip_heavy_modules(self):
+        times = self.importtime('import payflow.celery, batch.tasks, payflow.urls')
+        self.assertIn('batch.tasks', times)
+        self.assertIn('batch.views', times)
+        loaded = {module.split('.')[0] for module in times}
+        for module in self.LAZY_MODULES:
+            self.assertNotIn(module, loaded)
+
+    def test_pusher_client_is_built_once(self):
+        with mock.patch('batch.tasks._pusher', None):
+            from .tasks import get_pusher_client
+            self.assertIs(get_pusher_client(), get_pusher_client())
+
+    def test_preload_warms_parent_and_connects_children(self):
+        from celery.signals import worker_process_init
+        from payflow.celery import connect_worker_process, preload_worker
+
+        with mock.patch('batch.tasks.get_pusher_client') as get_client, \
+                mock.patch.object(connection, 'ensure_connection') as ensure, \
+                mock.patch.object(connection, 'close') as close:
+            preload_worker()
+        get_client.assert_called_once_with()
+        ensure.assert_called_once_with()
+        # the parent's socket is not handed down to the forked children
+        close.assert_called_once_with()
+
+        try:
+            with mock.patch.object(connection, 'ensure_connection') as ensure:
+                worker_process_init.send(sender=None)
+            ensure.assert_called_once_with()
+        finally:
+            worker_process_init.disconnect(connect_worker_process)
@@ -1,8 +1,14 @@
 from django.urls import path
-from .views import BatchUploadCreateView, BatchUploadDetailView, BatchItemListView
+from .views import (
+    BatchControlView, BatchItemListView, BatchUploadCreateView, BatchUploadDetailView, QueueMetricsView,
+)
 
 urlpatterns = [
     path('', BatchUploadCreateView.as_view(), name='batch-upload-create'),
     path('<int:pk>/', BatchUploadDetailView.as_view(), name='batch-upload-detail'),
     path('<int:batch_id>/items/', BatchItemListView.as_view(), name='batch-items-list'),
+    path('<int:pk>/pause/', BatchControlView.as_view(control='pause'), name='batch-pause'),
+    path('<int:pk>/resume/', BatchControlView.as_view(control='resume'), name='batch-resume'),
+    path('<int:pk>/cancel/', BatchControlView.as_view(control='cancel'), name='batch-cancel'),
+    path('queues/', QueueMetricsView.as_view(), name='batch-queue-metrics'),
 ]
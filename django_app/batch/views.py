@@ -4,21 +4,30 @@ import logging
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, IsAdminUser
 
-from openpyxl import load_workbook
 from django.db import transaction
 
 from .models import BatchUpload, BatchItem
-from .serializers import BatchUploadSerializer, BatchUploadCreateSerializer, BatchItemSerializer
-from .tasks import process_batch_item
+from .serializers import (
+    ITEM_ROW_COLUMNS, BatchItemSerializer, BatchUploadCreateSerializer, BatchUploadSerializer, encode_item_rows,
+)
+from .renderers import ORJSONRenderer
+from .tasks import cancel_batch, enqueue_items, pause_batch, resume_batch
 
 from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 from django.utils.dateparse import parse_datetime
-from decimal import Decimal
+from django.db.models import CharField, Q
+from django.db.models.functions import Cast
 
+from .normalize import phone_prefix_ranges, phone_to_int, to_minor_units
 from .pagination import StandardResultsSetPagination
+from .autoscale import scaling_decisions, send_latency
+from .routing import batch_queues
+from payflow.db_routers import ReplicaReadMixin, pin_to_primary
+from profiling.profiler import phase
 
 
 logger = logging.getLogger(__name__)
@@ -42,11 +51,15 @@ class BatchUploadCreateView(APIView):
 
         # Parse Excel and create items
         try:
-            in_memory = file_obj.read()
-            wb = load_workbook(filename=io.BytesIO(in_memory), data_only=True)
-            sheet = wb.active
+            with phase('parse'):
+                # imported here: openpyxl is heavy and only uploads need it
+                from openpyxl import load_workbook
 
-            rows = list(sheet.iter_rows(values_only=True))
+                in_memory = file_obj.read()
+                wb = load_workbook(filename=io.BytesIO(in_memory), data_only=True)
+                sheet = wb.active
+
+                rows = list(sheet.iter_rows(values_only=True))
             if not rows:
                 raise ValueError('Uploaded file is empty')
 
@@ -57,7 +70,7 @@ class BatchUploadCreateView(APIView):
             data_rows = rows[1:] if has_header else rows
 
             created_items = []
-            with transaction.atomic():
+            with phase('create_items'), transaction.atomic():
                 for i, row in enumerate(data_rows, start=1):
                     if not row or row[0] is None:
                         continue
@@ -72,11 +85,17 @@ class BatchUploadCreateView(APIView):
                         # skip invalid rows
                         continue
 
+                    try:
+                        phone_number = phone_to_int(phone)
+                    except ValueError:
+                        logger.warning('Skipping row %s of batch %s: invalid phone %r', i, batch.id, phone)
+                        continue
+
                     item = BatchItem.objects.create(
                         batch=batch,
                         row_number=i,
-                        phone=str(phone).strip(),
-                        amount=round(float(amount), 2),
+                        phone_number=phone_number,
+                        amount_minor=to_minor_units(amount),
                     )
                     created_items.append(item)
 
@@ -84,9 +103,13 @@ class BatchUploadCreateView(APIView):
             batch.save(update_fields=['total_rows'])
 
             # Enqueue tasks for each item (auto-start)
-            for item in created_items:
-                process_batch_item.apply_async(args=(item.id,))
+            with phase('enqueue'):
+                enqueue_items([(item.id, item.phone) for item in created_items])
 
+            # read-your-writes: keep the uploader off the replica until it catches
+            # up; pinned once everything is committed so that parsing a large
+            # file does not use up the window
+            pin_to_primary(request.user)
             response = BatchUploadSerializer(batch)
             return Response(response.data, status=status.HTTP_201_CREATED)
 
@@ -94,20 +117,53 @@ class BatchUploadCreateView(APIView):
             logger.exception('Failed to parse or process uploaded batch')
             batch.status = BatchUpload.STATUS_FAILED
             batch.save(update_fields=['status'])
+            pin_to_primary(request.user)
             return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class BatchUploadDetailView(generics.RetrieveAPIView):
+class BatchControlView(APIView):
+    """Pause, resume or cancel a batch (uploader or staff only).
+
+    The operation is chosen with ``as_view(control=...)``; invalid transitions
+    (e.g. resuming a batch that is not paused) return 409.
+    """
+    permission_classes = [IsAuthenticated]
+    control = None
+
+    HANDLERS = {
+        'pause': pause_batch,
+        'resume': resume_batch,
+        'cancel': cancel_batch,
+    }
+
+    def post(self, request, pk, format=None):
+        batch = get_object_or_404(BatchUpload, pk=pk)
+        user = request.user
+        if batch.uploaded_by and batch.uploaded_by != user and not user.is_staff:
+            raise PermissionDenied('You do not have permission to control this batch')
+
+        if not self.HANDLERS[self.control](batch):
+            batch.refresh_from_db(fields=['status'])
+            return Response(
+                {'detail': f'Cannot {self.control} a batch that is {batch.status}'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        pin_to_primary(user)
+        return Response(BatchUploadSerializer(batch).data)
+
+
+class BatchUploadDetailView(ReplicaReadMixin, generics.RetrieveAPIView):
     queryset = BatchUpload.objects.all()
     serializer_class = BatchUploadSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
-class BatchItemListView(generics.ListAPIView):
+class BatchItemListView(ReplicaReadMixin, generics.ListAPIView):
     """List items for a given batch with pagination and basic filtering.
 
     Supported query params:
       - status: exact match (pending, success, failed, ...)
-      - phone: substring match (icontains)
+      - phone: prefix match for +, 00 or 0 prefixed input (full or partial
+        number, national format allowed), digit substring match otherwise
       - row: exact row number
       - min_row, max_row
       - min_amount, max_amount
@@ -117,11 +173,22 @@ class BatchItemListView(generics.ListAPIView):
     serializer_class = BatchItemSerializer
     pagination_class = StandardResultsSetPagination
     permission_classes = [IsAuthenticated]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        # Fast path: plain tuples encoded like BatchItemSerializer, no model instances
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*ITEM_ROW_COLUMNS)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(encode_item_rows(page))
+        return Response(encode_item_rows(queryset))
 
     def get_queryset(self):
         ALLOWED_ORDERING = [
             'id', 'row_number', 'phone', 'amount', 'status', 'processed_at'
         ]
+        # API field names backed by differently named columns
+        ORDERING_COLUMNS = {'phone': 'phone_number', 'amount': 'amount_minor'}
         batch_id = self.kwargs.get('batch_id')
         # ensure batch exists and enforce simple ownership rule: only uploader or staff can view
         batch = get_object_or_404(BatchUpload, pk=batch_id)
@@ -138,7 +205,16 @@ class BatchItemListView(generics.ListAPIView):
 
         phone = params.get('phone')
         if phone:
-            qs = qs.filter(phone__icontains=phone)
+            if phone.strip().startswith(('+', '0')):
+                # +/00/0 prefixed input is (the start of) a number: index range
+                # scans on phone_number cover the full number and its prefixes
+                condition = Q()
+                for low, high in phone_prefix_ranges(phone):
+                    condition |= Q(phone_number__gte=low, phone_number__lt=high)
+                qs = qs.filter(condition) if condition else qs.none()
+            else:
+                digits = ''.join(c for c in phone if c.isdigit())
+                qs = qs.annotate(phone_text=Cast('phone_number', CharField())).filter(phone_text__contains=digits)
 
         row = params.get('row')
         if row:
@@ -164,14 +240,14 @@ class BatchItemListView(generics.ListAPIView):
         min_amount = params.get('min_amount')
         if min_amount:
             try:
-                qs = qs.filter(amount__gte=Decimal(min_amount))
+                qs = qs.filter(amount_minor__gte=to_minor_units(min_amount))
             except ValueError:
                 pass
 
         max_amount = params.get('max_amount')
         if max_amount:
             try:
-                qs = qs.filter(amount__lte=Decimal(max_amount))
+                qs = qs.filter(amount_minor__lte=to_minor_units(max_amount))
             except ValueError:
                 pass
 
@@ -193,9 +269,29 @@ class BatchItemListView(generics.ListAPIView):
             fields = []
             for f in ordering.split(','):
                 f = f.strip()
-                if f.lstrip('-') in ALLOWED_ORDERING:
-                    fields.append(f)
+                name = f.lstrip('-')
+                if name in ALLOWED_ORDERING:
+                    fields.append(f[:len(f) - len(name)] + ORDERING_COLUMNS.get(name, name))
             if fields:
                 qs = qs.order_by(*fields)
 
         return qs
+
+
+class QueueMetricsView(APIView):
+    """Staff-only view of per-queue send latency and the latest autoscaler decision."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        queues = batch_queues()
+        decisions = scaling_decisions(queues)
+        return Response({
+            'queues': [
+                {
+                    'queue': queue,
+                    'send_latency': send_latency(queue),
+                    'autoscaler': decisions[queue],
+                }
+                for queue in queues
+            ],
+        })
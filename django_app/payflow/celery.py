@@ -1,9 +1,53 @@
 from __future__ import absolute_import, unicode_literals
+import logging
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'payflow.settings')
 
+logger = logging.getLogger(__name__)
+
 app = Celery('payflow')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@worker_init.connect
+def preload_worker(**kwargs):
+    """Warm shared state in the parent worker before the pool forks.
+
+    Prefork children (including ones added later by the autoscaler) inherit
+    the loaded model metadata, the database backend state and the publisher
+    client instead of each building them on its first task.
+    """
+    from django.apps import apps
+    from django.db import connection
+
+    from batch.tasks import get_pusher_client
+
+    for model in apps.get_models():
+        model._meta.get_fields()
+    get_pusher_client()
+    try:
+        # first connect loads the driver and caches server version/settings on
+        # the wrapper; the socket itself must not be shared with the children
+        connection.ensure_connection()
+    except Exception:
+        logger.warning('Database not reachable while preloading worker', exc_info=True)
+    finally:
+        connection.close()
+
+    # Connected here rather than at import time so it runs after Celery's
+    # Django fixup has dropped the connections inherited from the parent.
+    worker_process_init.connect(connect_worker_process, weak=False)
+
+
+def connect_worker_process(**kwargs):
+    """Open the child's database connection before it takes its first task."""
+    from django.db import connection
+
+    try:
+        connection.ensure_connection()
+    except Exception:
+        logger.warning('Database not reachable at worker process start', exc_info=True)
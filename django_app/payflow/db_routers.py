@@ -0,0 +1,124 @@
+import contextvars
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+# Set while a read-only view is being served; the router only sends reads to
+# the replica when this is True, so workers and writes never touch it.
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+# Per-process cache of the last lag measurement: {alias: (checked_at, lag_seconds)}
+_lag_cache = {}
+
+
+def replica_alias():
+    """Return the configured replica alias, or None when no replica is defined."""
+    alias = getattr(settings, 'REPLICA_DATABASE_ALIAS', None)
+    if alias and alias != DEFAULT_DB_ALIAS and alias in connections:
+        return alias
+    return None
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user):
+    """Keep this user's reads on the primary for a short read-your-writes window."""
+    if user is None or not user.is_authenticated:
+        return
+    cache.set(_pin_key(user.pk), 1, timeout=settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned_to_primary(user):
+    if user is None or not user.is_authenticated:
+        return False
+    return cache.get(_pin_key(user.pk)) is not None
+
+
+def _measure_lag(alias):
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        # Stand-in databases (e.g. SQLite in tests) have no replication to lag behind
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        row = cursor.fetchone()
+    return float(row[0] or 0)
+
+
+def replica_lag_seconds(alias):
+    """Return the replica lag in seconds, or None if it cannot be measured.
+
+    Measurements are cached per process for REPLICA_LAG_CHECK_INTERVAL seconds
+    so the check costs at most one query per interval.
+    """
+    now = time.monotonic()
+    cached = _lag_cache.get(alias)
+    if cached and now - cached[0] < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return cached[1]
+    try:
+        lag = _measure_lag(alias)
+    except Exception:
+        logger.exception('Failed to measure replication lag for %s', alias)
+        lag = None
+    _lag_cache[alias] = (now, lag)
+    return lag
+
+
+def replica_is_healthy(alias):
+    lag = replica_lag_seconds(alias)
+    return lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS
+
+
+class PrimaryReplicaRouter:
+    """Send reads from read-only API views to the replica, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        alias = replica_alias()
+        if alias is None or not replica_is_healthy(alias):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """DRF view mixin routing safe-method requests to the read replica.
+
+    The decision is taken after authentication so that users who have just
+    written (see ``pin_to_primary``) keep reading from the primary.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _replica_reads.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_pinned_to_primary(request.user):
+            _replica_reads.set(True)
@@ -17,13 +17,14 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
-# Load .env from repository root (one level above django_app) if present
-from dotenv import load_dotenv
-env_path = BASE_DIR / ".env"
-if not env_path.exists():
-    env_path = BASE_DIR.parent / ".env"
-if env_path.exists():
-    load_dotenv(env_path)
+# Load .env from django_app or the repository root if present. Containers get
+# their environment from docker-compose, so python-dotenv is only imported
+# when there is a file to read.
+for env_path in (BASE_DIR / ".env", BASE_DIR.parent / ".env"):
+    if env_path.is_file():
+        from dotenv import load_dotenv
+        load_dotenv(env_path)
+        break
 
 
 # Quick-start development settings - unsuitable for production
@@ -51,8 +52,20 @@ if os.environ.get("DB_NAME"):
             "PASSWORD": os.environ.get("DB_PASSWORD"),
             "HOST": os.environ.get("DB_HOST", "db"),
             "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+            # Keep connections open between requests/tasks instead of paying a
+            # new connect per task; health checks drop ones the server closed.
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
         }
     }
+    # Optional streaming replica used for read-only API traffic (see payflow.db_routers)
+    if os.environ.get("DB_REPLICA_HOST"):
+        DATABASES["replica"] = {
+            **DATABASES["default"],
+            "HOST": os.environ.get("DB_REPLICA_HOST"),
+            "PORT": os.environ.get("DB_REPLICA_PORT", DATABASES["default"]["PORT"]),
+            "TEST": {"MIRROR": "default"},
+        }
 else:
     DATABASES = {
         "default": {
@@ -61,6 +74,31 @@ else:
         }
     }
 
+DATABASE_ROUTERS = ['payflow.db_routers.PrimaryReplicaRouter']
+
+# Read-replica routing: alias used for read-only endpoints, how long a user stays
+# pinned to the primary after one of their own writes, and the maximum tolerated
+# replication lag before reads fall back to the primary.
+REPLICA_DATABASE_ALIAS = os.environ.get("DB_REPLICA_ALIAS", "replica")
+REPLICA_STICKY_SECONDS = int(os.environ.get("DB_REPLICA_STICKY_SECONDS", "15"))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get("DB_REPLICA_LAG_CHECK_INTERVAL", "2"))
+
+# Cache: shared Redis cache when configured, per-process memory otherwise
+if os.environ.get("CACHE_REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get("CACHE_REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -75,6 +113,7 @@ INSTALLED_APPS = [
     'django_celery_results',
     # Local apps
     'batch',
+    'profiling',
 ]
 
 MIDDLEWARE = [
@@ -86,6 +125,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'profiling.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'payflow.urls'
@@ -108,6 +148,17 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'payflow.wsgi.application'
 
+# On-demand profiling (off by default). When enabled, staff requests carrying
+# the PROFILING_HEADER header and a PROFILING_TASK_SAMPLE_RATE fraction of
+# Celery tasks are profiled; reports are written to PROFILING_DIR and listed
+# at /api/profiles/.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILING_HEADER = os.environ.get('PROFILING_HEADER', 'X-Profile')
+PROFILING_TASK_SAMPLE_RATE = float(os.environ.get('PROFILING_TASK_SAMPLE_RATE', '0'))
+PROFILING_SAMPLE_INTERVAL = float(os.environ.get('PROFILING_SAMPLE_INTERVAL', '0.005'))
+PROFILING_DIR = os.environ.get('PROFILING_DIR', str(BASE_DIR / 'profiles'))
+PROFILING_MAX_REPORTS = int(os.environ.get('PROFILING_MAX_REPORTS', '200'))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -162,6 +213,70 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', CELERY_RESULT_BACKEND)
 CELERY_CACHE_BACKEND = None
 
+# Crash-safe processing: a task is only acknowledged once it finishes, so a
+# message held by a dead worker is redelivered after the visibility timeout.
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': int(os.environ.get('CELERY_VISIBILITY_TIMEOUT', '600')),
+}
+# Celery closes the DB connection around every task unless this is set; reuse
+# it for this many tasks so workers don't reconnect for each item.
+CELERY_DB_REUSE_MAX = int(os.environ.get('CELERY_DB_REUSE_MAX', '100'))
+
+# Item leases: a processing item whose lease is not renewed within this window
+# is considered stuck and is re-enqueued by the reaper.
+BATCH_ITEM_LEASE_SECONDS = int(os.environ.get('BATCH_ITEM_LEASE_SECONDS', '60'))
+BATCH_ITEM_MAX_ATTEMPTS = int(os.environ.get('BATCH_ITEM_MAX_ATTEMPTS', '3'))
+BATCH_REAPER_INTERVAL = float(os.environ.get('BATCH_REAPER_INTERVAL', '30'))
+BATCH_REAPER_CHUNK_SIZE = int(os.environ.get('BATCH_REAPER_CHUNK_SIZE', '1000'))
+
+# How long a worker trusts its local copy of a batch pause/cancel flag
+BATCH_CONTROL_LOCAL_TTL = float(os.environ.get('BATCH_CONTROL_LOCAL_TTL', '1'))
+
+# Admin changelists report planner estimates instead of exact counts above this many rows
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.environ.get('ADMIN_ESTIMATED_COUNT_THRESHOLD', '100000'))
+
+# Live batch progress: completions are counted in BATCH_PROGRESS_BUCKET_SECONDS
+# buckets and the throughput is an exponentially weighted average (half-life
+# BATCH_PROGRESS_HALF_LIFE seconds) over the last BATCH_PROGRESS_WINDOW_BUCKETS.
+BATCH_PROGRESS_BUCKET_SECONDS = int(os.environ.get('BATCH_PROGRESS_BUCKET_SECONDS', '5'))
+BATCH_PROGRESS_WINDOW_BUCKETS = int(os.environ.get('BATCH_PROGRESS_WINDOW_BUCKETS', '24'))
+BATCH_PROGRESS_HALF_LIFE = float(os.environ.get('BATCH_PROGRESS_HALF_LIFE', '30'))
+
+# Country code applied to national phone numbers (leading 0) at ingest
+PHONE_DEFAULT_COUNTRY_CODE = os.environ.get('PHONE_DEFAULT_COUNTRY_CODE', '261')
+# Digits of a national number without its trunk 0 (Madagascar: 34 12 345 67).
+# Numeric Excel cells drop the leading 0, so a numeric phone this short is
+# read as national rather than as an international number.
+PHONE_NATIONAL_NUMBER_DIGITS = int(os.environ.get('PHONE_NATIONAL_NUMBER_DIGITS', '9'))
+
+# Queue routing: items are sent to a per-operator/modem-group queue chosen by
+# phone prefix, e.g. BATCH_PHONE_PREFIX_QUEUES="+26132:batch.orange,+26134:batch.telma".
+# Anything unmatched goes to BATCH_DEFAULT_QUEUE.
+BATCH_DEFAULT_QUEUE = os.environ.get('BATCH_DEFAULT_QUEUE', 'celery')
+BATCH_PHONE_PREFIX_QUEUES = dict(
+    entry.strip().split(':', 1)
+    for entry in os.environ.get('BATCH_PHONE_PREFIX_QUEUES', '').split(',')
+    if entry.strip()
+)
+
+# Autoscaling (used by workers started with --autoscale=max,min): size each
+# pool so its queue backlog drains within BATCH_AUTOSCALE_DRAIN_SECONDS.
+CELERY_WORKER_AUTOSCALER = 'batch.autoscale:QueueDepthAutoscaler'
+BATCH_AUTOSCALE_DRAIN_SECONDS = float(os.environ.get('BATCH_AUTOSCALE_DRAIN_SECONDS', '120'))
+BATCH_AUTOSCALE_SAMPLE_SECONDS = float(os.environ.get('BATCH_AUTOSCALE_SAMPLE_SECONDS', '5'))
+
+CELERY_BEAT_SCHEDULE = {
+    'reap-stuck-batch-items': {
+        'task': 'batch.tasks.reap_stuck_items',
+        'schedule': BATCH_REAPER_INTERVAL,
+        # the default queue always has a consumer, operator queues may not
+        'options': {'queue': BATCH_DEFAULT_QUEUE},
+    },
+}
+
 
 #File upload settings
 FILE_UPLOAD_HANDLERS = (
@@ -21,5 +21,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/batches/', include('batch.urls')),
     path('api/accounts/', include('account.urls')),
+    path('api/profiles/', include('profiling.urls')),
     path('api/auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
@@ -0,0 +1,20 @@
+from django.apps import AppConfig
+
+
+class ProfilingConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'profiling'
+    verbose_name = 'Profiling'
+
+    def ready(self):
+        from django.conf import settings
+
+        # Nothing is connected unless task profiling is switched on, so
+        # workers pay no per-task cost by default.
+        if settings.PROFILING_ENABLED and settings.PROFILING_TASK_SAMPLE_RATE > 0:
+            from celery.signals import task_postrun, task_prerun
+
+            from .signals import start_task_profile, stop_task_profile
+
+            task_prerun.connect(start_task_profile, dispatch_uid='profiling.task_prerun')
+            task_postrun.connect(stop_task_profile, dispatch_uid='profiling.task_postrun')
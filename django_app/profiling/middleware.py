@@ -0,0 +1,50 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .profiler import Profile, save_report
+
+logger = logging.getLogger(__name__)
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        # API clients authenticate with a token, which DRF only checks inside the view
+        try:
+            authenticated = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        user = authenticated[0] if authenticated else None
+    return bool(user and user.is_active and user.is_staff)
+
+
+class ProfilingMiddleware:
+    """Profile a single request when a staff user sends the PROFILING_HEADER header.
+
+    Removed from the middleware chain entirely unless PROFILING_ENABLED is set.
+    The report id is returned in the ``X-Profile-Id`` response header.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.PROFILING_HEADER not in request.headers or not _is_staff(request):
+            return self.get_response(request)
+
+        profile = Profile('request', f'{request.method} {request.path}')
+        with profile:
+            response = self.get_response(request)
+        try:
+            save_report(profile.report())
+        except Exception:
+            logger.exception('Failed to save profile %s', profile.id)
+        else:
+            response['X-Profile-Id'] = profile.id
+        return response
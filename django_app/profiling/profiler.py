@@ -0,0 +1,186 @@
+import contextvars
+import json
+import logging
+import sys
+import threading
+import uuid
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# The profile running in the current request/task, if any
+_active = contextvars.ContextVar('active_profile', default=None)
+
+MAX_STACK_DEPTH = 64
+TOP_STACKS = 50
+TOP_FUNCTIONS = 30
+
+
+@contextmanager
+def phase(name):
+    """Attribute the SQL and time of the enclosed block to phase ``name``.
+
+    Costs a single context-variable lookup when no profile is running.
+    """
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    previous, started = profile.phase, perf_counter()
+    profile.phase = name
+    try:
+        yield
+    finally:
+        profile.phase_times[name] += perf_counter() - started
+        profile.phase = previous
+
+
+class Profile:
+    """Sampling profiler plus SQL query log for one request or task.
+
+    A daemon thread samples the profiled thread's stack every
+    PROFILING_SAMPLE_INTERVAL seconds; every query run meanwhile is logged
+    with its duration and the phase (see ``phase``) it ran in.
+    """
+
+    def __init__(self, kind, name):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.name = name
+        self.phase = 'other'
+        self.phase_times = defaultdict(float)
+        self.queries = []
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration = None
+        self._thread_id = None
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._exit_stack = None
+        self._token = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.started_at = timezone.now()
+        self._started = perf_counter()
+        self._thread_id = threading.get_ident()
+        self._exit_stack = ExitStack()
+        for connection in connections.all():
+            self._exit_stack.enter_context(connection.execute_wrapper(self._log_query))
+        self._token = _active.set(self)
+        self._sampler = threading.Thread(target=self._sample, name=f'profiler-{self.id}', daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+        _active.reset(self._token)
+        self._exit_stack.close()
+        self.duration = perf_counter() - self._started
+
+    def _sample(self):
+        interval = settings.PROFILING_SAMPLE_INTERVAL
+        while not self._stopped.wait(interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def _log_query(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'phase': self.phase,
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'duration': perf_counter() - started,
+            })
+
+    def report(self):
+        functions = Counter()
+        for stack, count in self.stacks.items():
+            # inclusive counts: a function is counted once per sample it appears in
+            for frame in set(stack.split(';')):
+                functions[frame] += count
+
+        phases = defaultdict(lambda: {'time': 0.0, 'queries': 0, 'query_time': 0.0})
+        for name, elapsed in self.phase_times.items():
+            phases[name]['time'] = elapsed
+        for query in self.queries:
+            phases[query['phase']]['queries'] += 1
+            phases[query['phase']]['query_time'] += query['duration']
+
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'duration': self.duration,
+            'samples': self.samples,
+            'sample_interval': settings.PROFILING_SAMPLE_INTERVAL,
+            'query_count': len(self.queries),
+            'phases': dict(phases),
+            'functions': functions.most_common(TOP_FUNCTIONS),
+            # collapsed "a;b;c count" stacks, ready for flamegraph tools
+            'stacks': self.stacks.most_common(TOP_STACKS),
+            'queries': self.queries,
+        }
+
+
+def _report_dir():
+    return Path(settings.PROFILING_DIR)
+
+
+def save_report(report):
+    """Write ``report`` to PROFILING_DIR, keeping the newest PROFILING_MAX_REPORTS."""
+    directory = _report_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    filename = f"{report['started_at'][:19].replace(':', '')}-{report['id']}.json"
+    (directory / filename).write_text(json.dumps(report, default=str))
+    for old in sorted(directory.glob('*.json'))[:-settings.PROFILING_MAX_REPORTS]:
+        old.unlink(missing_ok=True)
+
+
+def list_reports():
+    """Summaries of the stored reports, newest first."""
+    summaries = []
+    for path in sorted(_report_dir().glob('*.json'), reverse=True):
+        try:
+            report = json.loads(path.read_text())
+        except (OSError, ValueError):
+            logger.warning('Skipping unreadable profile report %s', path)
+            continue
+        summaries.append({
+            key: report[key]
+            for key in ('id', 'kind', 'name', 'started_at', 'duration', 'samples', 'query_count')
+        })
+    return summaries
+
+
+def load_report(report_id):
+    if not report_id.isalnum():
+        return None
+    for path in _report_dir().glob(f'*-{report_id}.json'):
+        return json.loads(path.read_text())
+    return None
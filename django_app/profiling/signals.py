@@ -0,0 +1,30 @@
+import logging
+import random
+
+from django.conf import settings
+
+from .profiler import Profile, save_report
+
+logger = logging.getLogger(__name__)
+
+# Profiles of the tasks currently running in this worker process, by task id
+_task_profiles = {}
+
+
+def start_task_profile(sender=None, task_id=None, task=None, **kwargs):
+    if random.random() >= settings.PROFILING_TASK_SAMPLE_RATE:
+        return
+    profile = Profile('task', task.name if task is not None else str(sender))
+    profile.start()
+    _task_profiles[task_id] = profile
+
+
+def stop_task_profile(sender=None, task_id=None, **kwargs):
+    profile = _task_profiles.pop(task_id, None)
+    if profile is None:
+        return
+    profile.stop()
+    try:
+        save_report(profile.report())
+    except Exception:
+        logger.exception('Failed to save profile %s', profile.id)
@@ -0,0 +1,96 @@
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from batch.models import BatchUpload
+from .profiler import Profile, _active, list_reports, phase
+from .signals import start_task_profile, stop_task_profile
+
+User = get_user_model()
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        self.report_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.report_dir)
+        settings_override = override_settings(
+            PROFILING_ENABLED=True, PROFILING_DIR=self.report_dir, PROFILING_SAMPLE_INTERVAL=0.001,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.staff = User.objects.create_user(username='judy', password='password', is_staff=True)
+        self.batch = BatchUpload.objects.create(original_filename='test.xlsx', uploaded_by=self.staff)
+        self.url = reverse('batch-upload-detail', kwargs={'pk': self.batch.id})
+
+    def _token_client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        return client
+
+    def test_staff_header_profiles_request(self):
+        client = self._token_client(self.staff)
+        resp = client.get(self.url, HTTP_X_PROFILE='1')
+        self.assertEqual(resp.status_code, 200)
+        report_id = resp['X-Profile-Id']
+
+        resp = client.get(reverse('profile-list'))
+        self.assertEqual([r['id'] for r in resp.data['results']], [report_id])
+
+        report = client.get(reverse('profile-detail', kwargs={'report_id': report_id})).data
+        self.assertEqual(report['name'], f'GET {self.url}')
+        self.assertGreater(report['query_count'], 0)
+        self.assertTrue(all('sql' in q and 'phase' in q for q in report['queries']))
+
+    def test_header_ignored_for_non_staff(self):
+        user = User.objects.create_user(username='mallory', password='password')
+        resp = self._token_client(user).get(self.url, HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', resp)
+        self.assertEqual(list_reports(), [])
+
+    def test_profiling_disabled_removes_middleware(self):
+        with override_settings(PROFILING_ENABLED=False):
+            resp = self._token_client(self.staff).get(self.url, HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', resp)
+        self.assertEqual(list_reports(), [])
+
+    def test_reports_are_staff_only(self):
+        user = User.objects.create_user(username='oscar', password='password')
+        self.assertEqual(self._token_client(user).get(reverse('profile-list')).status_code, 403)
+
+    def test_phases_collect_queries_and_samples(self):
+        with Profile('request', 'test') as profile:
+            with phase('load'):
+                list(BatchUpload.objects.all())
+            with phase('send'):
+                time.sleep(0.02)
+        report = profile.report()
+        self.assertEqual(report['phases']['load']['queries'], 1)
+        self.assertGreaterEqual(report['phases']['send']['time'], 0.02)
+        self.assertGreater(report['samples'], 0)
+        self.assertIsNone(_active.get())
+
+    def test_phase_is_a_noop_without_profile(self):
+        with phase('load'):
+            self.assertIsNone(_active.get())
+
+    def test_sampled_tasks_are_profiled(self):
+        task = type('Task', (), {'name': 'batch.tasks.process_batch_item'})()
+        with override_settings(PROFILING_TASK_SAMPLE_RATE=1.0):
+            start_task_profile(task_id='abc', task=task)
+            list(BatchUpload.objects.all())
+            stop_task_profile(task_id='abc')
+        with override_settings(PROFILING_TASK_SAMPLE_RATE=0.0):
+            start_task_profile(task_id='def', task=task)
+            stop_task_profile(task_id='def')
+
+        reports = list_reports()
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]['kind'], 'task')
+        self.assertEqual(reports[0]['query_count'], 1)
@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import ProfileDetailView, ProfileListView
+
+urlpatterns = [
+    path('', ProfileListView.as_view(), name='profile-list'),
+    path('<str:report_id>/', ProfileDetailView.as_view(), name='profile-detail'),
+]
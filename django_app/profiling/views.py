@@ -0,0 +1,24 @@
+from django.http import Http404
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .profiler import list_reports, load_report
+
+
+class ProfileListView(APIView):
+    """Stored profiling reports, newest first (staff only)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        return Response({'results': list_reports()})
+
+
+class ProfileDetailView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, report_id, format=None):
+        report = load_report(report_id)
+        if report is None:
+            raise Http404
+        return Response(report)